@@ -1,108 +1,519 @@
-import tiktoken
+import os
+import time
+import asyncio
+from contextvars import copy_context
 from termcolor import colored
+from concurrent.futures import ThreadPoolExecutor
 from langgraph.prebuilt import ToolInvocation
-from typing import TypedDict, Sequence
+from functools import partial
+from typing import Annotated, List, Optional, Tuple, TypedDict, Sequence
 from langchain_core.messages import ToolMessage, BaseMessage
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.outputs import ChatResult
+from langchain_openai import ChatOpenAI
+from tokens import count_messages_tokens, estimate_cost, response_usage
+from tools import ratelimit
+from tools.blobstore import BLOB_MIN_CHARS, get_blob_store, stub
+from tools.instrumentation import count, span
+from tools.utils import ToolResponse, canonical_url
+from reduction import ContentReducer
+from extractors import extract_data_points, on_entity_domain, prefill_data_points
+
+class ReplaceMessages(list):
+  """Messages a node returns to replace the whole history instead of appending to it."""
+
+def append_messages(messages: Sequence[BaseMessage], new_messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+  """
+  Reduces the messages of the state: nodes return only the messages they add, or ReplaceMessages.
+  """
+  if isinstance(new_messages, ReplaceMessages):
+    return list(new_messages)
+  return list(messages or []) + list(new_messages or [])
 
 class AgentState(TypedDict):
-   messages: Sequence[BaseMessage]
+   messages: Annotated[List[BaseMessage], append_messages]
+   entity_name: str
+   data_points: List[dict]
+   links_already_scraped: List[str]
+   summary: str
+   turns: int
+   tokens: int
+   cost: float
+   elapsed: float
 
-def call_model(state, llm):
-  messages = state['messages']
+class RunBudget(TypedDict, total=False):
+   min_coverage: float
+   max_turns: int
+   max_tokens: int
+   max_seconds: float
+   max_cost: float
+
+def default_budget() -> RunBudget:
+  """
+  Returns the per-entity budget configured through RUN_MIN_COVERAGE, RUN_MAX_TURNS, RUN_MAX_TOKENS,
+  RUN_MAX_SECONDS and RUN_MAX_COST; limits left unset do not apply.
+  """
+  budget = RunBudget(min_coverage=float(os.getenv("RUN_MIN_COVERAGE", 1.0)))
+  for key, cast in [("max_turns", int), ("max_tokens", int), ("max_seconds", float), ("max_cost", float)]:
+    value = os.getenv(f"RUN_{key.upper()}")
+    if value:
+      budget[key] = cast(value)
+  return budget
+
+def coverage(state) -> float:
+  data_points = state.get('data_points') or []
+  if not data_points:
+    return 0.0
+  return sum(1 for dp in data_points if dp["value"] is not None) / len(data_points)
+
+def budget_exhausted(state, budget: Optional[RunBudget]) -> Optional[str]:
+  """
+  Returns why the run should end when the data points are covered or a per-entity limit is reached, otherwise None.
+  """
+  budget = budget or {}
+  if state.get('data_points') and coverage(state) >= budget.get("min_coverage", 1.0):
+    return f"data points coverage {coverage(state):.0%}"
+  limits = [("max_turns", "turns"), ("max_tokens", "tokens"), ("max_seconds", "elapsed"), ("max_cost", "cost")]
+  for limit, key in limits:
+    if limit in budget and (state.get(key) or 0) >= budget[limit]:
+      return f"{key} {state.get(key)} reached {limit} {budget[limit]}"
+  return None
+
+def from_cache(response) -> bool:
+  """
+  Tells whether response was replayed from the LLM cache, without a call to the API.
+  """
+  return bool((getattr(response, "response_metadata", None) or {}).get("cached"))
+
+def usage_update(state, started: float, model: str, response, messages) -> dict:
+  """
+  Returns the state update accounting for the time, tokens and cost of a node; replayed responses are free.
+  """
+  update = {"elapsed": (state.get('elapsed') or 0.0) + time.time() - started}
+  if response is not None and model and not from_cache(response):
+    prompt_tokens, completion_tokens = response_usage(response, messages, model)
+    update["tokens"] = (state.get('tokens') or 0) + prompt_tokens + completion_tokens
+    update["cost"] = (state.get('cost') or 0.0) + estimate_cost(model, prompt_tokens, completion_tokens)
+  return update
+
+def prompt_tokens(messages, model: str) -> int:
+  return count_messages_tokens(messages, model) if model else 0
+
+def record_completion(response, messages, model: str, usage: dict):
+  """
+  Adds the call's tokens and cost to its span, unless it was replayed from the LLM cache.
+  """
+  if model and not from_cache(response):
+    prompt, completion = response_usage(response, messages, model)
+    usage.update({"prompt_tokens": prompt, "completion_tokens": completion, "cost": estimate_cost(model, prompt, completion)})
+
+def offload(tool_message: ToolMessage) -> ToolMessage:
+  """
+  Moves the content of a large tool message to the blob store, leaving its beginning and handle in the state.
+  """
+  content = tool_message.content
+  if not isinstance(content, str) or len(content) <= BLOB_MIN_CHARS:
+    return tool_message
+  handle = get_blob_store().put(content)
+  return ToolMessage(content=stub(content, handle), name=tool_message.name, tool_call_id=tool_message.tool_call_id, additional_kwargs={"blob": handle})
+
+def materialize(messages) -> List[BaseMessage]:
+  """
+  Returns messages with the full content of offloaded tool messages, as they are sent to the model.
+  """
+  materialized = []
+  for message in messages:
+    handle = message.additional_kwargs.get("blob") if isinstance(message, ToolMessage) else None
+    content = get_blob_store().get(handle) if handle else None
+    if content is None:
+      materialized.append(message)
+      continue
+    ### Notes appended after offloading, such as the data points extracted, follow the full content
+    full = message.content.replace(stub(content, handle), content, 1)
+    materialized.append(ToolMessage(content=full, name=message.name, tool_call_id=message.tool_call_id))
+  return materialized
+
+class GovernedChatOpenAI(ChatOpenAI):
+  """
+  ChatOpenAI whose API requests go through the OpenAI request and token quotas, backing off on 429.
+
+  Only _generate reaches the API: responses replayed from the LLM cache never get there, so they
+  return at local-disk speed without taking any quota.
+  """
+
+  def _charge(self, result: ChatResult) -> ChatResult:
+    ### The completion tokens are unknown when the request is admitted
+    reported = getattr(result.generations[0].message, "usage_metadata", None) if result.generations else None
+    if reported:
+      ratelimit.get_governor("openai").record(reported.get("output_tokens", 0))
+    return result
+
+  def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+    generate = super()._generate
+    return self._charge(ratelimit.call("openai", lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs), prompt_tokens(messages, self.model_name)))
+
+  async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+    agenerate = super()._agenerate
+    return self._charge(await ratelimit.acall("openai", lambda: agenerate(messages, stop=stop, run_manager=run_manager, **kwargs), prompt_tokens(messages, self.model_name)))
+
+def invoke_model(llm, messages, model: str = "", stage: str = "llm:agent"):
+  """
+  Invokes llm, timed as stage with its tokens and cost.
+  """
+  with span(stage) as usage:
+    response = llm.invoke(messages)
+    record_completion(response, messages, model, usage)
+  return response
+
+async def ainvoke_model(llm, messages, model: str = "", stage: str = "llm:agent"):
+  with span(stage) as usage:
+    response = await llm.ainvoke(messages)
+    record_completion(response, messages, model, usage)
+  return response
+
+### Tool calls of one turn run at most this many at a time; every turn gets its own threads, so entities
+### running side by side never queue behind each other's tool calls
+TOOL_CALL_WORKERS = int(os.getenv("TOOL_CALL_WORKERS", 4))
+
+def call_model(state, llm, model: str = ""):
+  started = time.time()
+  messages = materialize(state['messages'])
   response = None
   try:
-    response = llm.invoke(messages)
+    response = invoke_model(llm, messages, model)
   except Exception as e:
     print(colored(f"error while processing messages: {e}", "red"))
-  return {"messages": messages + [response]}
+    count("errors:model")
+  return {"messages": [response], "turns": (state.get('turns') or 0) + 1, **usage_update(state, started, model, response, messages)}
 
-def should_continue(state):
+async def acall_model(state, llm, model: str = ""):
+  started = time.time()
+  messages = await asyncio.to_thread(materialize, state['messages'])
+  response = None
+  try:
+    response = await ainvoke_model(llm, messages, model)
+  except Exception as e:
+    print(colored(f"error while processing messages: {e}", "red"))
+    count("errors:model")
+  return {"messages": [response], "turns": (state.get('turns') or 0) + 1, **usage_update(state, started, model, response, messages)}
+
+def should_continue(state, budget: Optional[RunBudget] = None):
+  """
+  Ends the run once the model makes no tool calls; the budget is checked after its tool calls ran,
+  so the data points of a last update_data call are always saved.
+  """
   messages = state['messages']
   last_message = messages[-1]
   if last_message is None or "tool_calls" not in last_message.additional_kwargs:
     return "end"
+  return "continue"
+
+def should_optimise(state, budget: Optional[RunBudget] = None):
+  """
+  Ends the run right after a tool step that completed the data points or reached a per-entity limit,
+  without another model turn.
+  """
+  reason = budget_exhausted(state, budget)
+  if reason:
+    print(colored(f"ending run: {reason}", "yellow"))
+    return "end"
+  return "continue"
+
+def tool_action(tool_call, state_input: Optional[dict] = None) -> ToolInvocation:
+  action = ToolInvocation(
+    tool=tool_call["name"],
+    tool_input=tool_call["args"]
+  )
+  print(f"""The agent action is {action} and the tool call id: {tool_call["id"]}""")
+  if state_input:
+    action = ToolInvocation(tool=action.tool, tool_input={**action.tool_input, **state_input})
+  return action
+
+def tool_result(tool_call, response, reducer: Optional[ContentReducer] = None, missing_data_points: Optional[List[str]] = None, entity_name: str = "") -> Tuple[ToolMessage, dict]:
+  """
+  Turns a tool response into its message and context, with any data points extracted
+  from a scraped page under "extracted".
+  """
+  content = response.result
+  context = dict(response.context)
+  if "error" in context:
+    print(colored(f"""error: {context["error"]}""", "red"))
+    count(f"""errors:{tool_call["name"]}""")
+    content = f"""error: {context["error"]}"""
   else:
-    return "continue"
-  
-def call_tool(state, tool_executor):
+    ### Reading the fields regular expressions can find off the full page before it is reduced, only on the
+    ### entity's own site: directories and news pages list other companies' emails and phones
+    url = tool_call["args"].get("url", "")
+    if tool_call["name"] == "scrape" and missing_data_points and on_entity_domain(url, entity_name):
+      context["extracted"] = extract_data_points(str(content), url, missing_data_points)
+    if reducer is not None:
+      content = reducer(str(content), tool_call["name"], missing_data_points or [], entity_name)
+
+  return offload(ToolMessage(content=str(content), name=tool_call["name"], tool_call_id=tool_call["id"])), context
+
+def tool_response(response) -> ToolResponse:
+  """
+  Returns response as a ToolResponse; ToolExecutor answers calls to tools it does not have with a plain string.
+  """
+  if isinstance(response, ToolResponse):
+    return response
+  return ToolResponse(result="", context={"error": str(response)})
+
+def execute_tool_call(tool_call, tool_executor, state_input: Optional[dict] = None, **options) -> Tuple[ToolMessage, dict]:
+  with span(f"""tool:{tool_call["name"]}""") as counters:
+    response = tool_response(tool_executor.invoke(tool_action(tool_call, state_input)))
+    counters["bytes"] = len(str(response.result))
+  with span("reduce"):
+    return tool_result(tool_call, response, **options)
+
+async def aexecute_tool_call(tool_call, tool_executor, state_input: Optional[dict] = None, **options) -> Tuple[ToolMessage, dict]:
+  with span(f"""tool:{tool_call["name"]}""") as counters:
+    response = tool_response(await tool_executor.ainvoke(tool_action(tool_call, state_input)))
+    counters["bytes"] = len(str(response.result))
+  ### Extraction and reduction tokenize whole pages, kept off the event loop
+  with span("reduce"):
+    return await asyncio.to_thread(tool_result, tool_call, response, **options)
+
+def skipped_tool_calls(tool_calls, links_already_scraped: List[str]) -> dict:
+  """
+  Returns error messages, by tool call index, for urls already scraped for this entity under any spelling,
+  including the same url twice in one turn.
+  """
+  skipped = {}
+  scraped = {canonical_url(link) for link in links_already_scraped}
+  for i, tool_call in enumerate(tool_calls):
+    if tool_call["name"] != "scrape":
+      continue
+    url = tool_call["args"].get("url", "")
+    if canonical_url(url) in scraped:
+      skipped[i] = ToolMessage(content=f"error: this url: {url} is already scraped; please use different relevant url from the content scraped before.", name="scrape", tool_call_id=tool_call["id"])
+    scraped.add(canonical_url(url))
+  return skipped
+
+def merge_tool_result(tool_call, tool_message: ToolMessage, context: dict, data_points: List[dict], links_already_scraped: List[str]) -> List[dict]:
+  """
+  Records a scraped url and saves the data points extracted from it, returning the updated data points.
+  """
+  if tool_call["name"] == "scrape" and "error" not in context:
+    links_already_scraped.append(tool_call["args"].get("url", ""))
+  if context.get("extracted"):
+    data_points, saved = prefill_data_points(data_points, context["extracted"])
+    if saved:
+      print(colored(f"extracted data points: {saved}", "green"))
+      tool_message.content += f"""
+
+        Data points extracted automatically from this page and already saved with update_data: {saved}
+        """
+  return data_points
+
+def tool_options(state, reducer: Optional[ContentReducer]) -> dict:
+  return {"reducer": reducer,
+          "missing_data_points": [dp["name"] for dp in state.get('data_points') or [] if dp["value"] is None],
+          "entity_name": state.get('entity_name') or ""}
+
+def call_tool(state, tool_executor, reducer: Optional[ContentReducer] = None):
+  started = time.time()
   messages = state['messages']
-  last_message = messages[-1]
+  tool_calls = messages[-1].tool_calls
+  data_points = state.get('data_points') or []
+  links_already_scraped = list(state.get('links_already_scraped') or [])
+  execute = partial(execute_tool_call, tool_executor=tool_executor, **tool_options(state, reducer))
+  skipped = skipped_tool_calls(tool_calls, links_already_scraped)
+
+  ### Independent tool calls run concurrently; update_data calls stay serialized in this thread
+  ### since they update the data points, and messages keep the order of the tool calls
+  parallel = [i for i, tool_call in enumerate(tool_calls) if tool_call["name"] != "update_data" and i not in skipped]
+  futures = {}
+  pool = None
+  if len(parallel) > 1:
+    pool = ThreadPoolExecutor(max_workers=min(len(parallel), max(1, TOOL_CALL_WORKERS)), thread_name_prefix="tool-call")
+    ### Each call runs in a copy of this context so its spans count towards the current entity
+    futures = {i: pool.submit(copy_context().run, execute, tool_calls[i]) for i in parallel}
+
   tool_messages = []
-  for tool_call in last_message.tool_calls:
-    action = ToolInvocation(
-      tool=tool_call["name"],
-      tool_input=tool_call["args"]
-    )
-    print(f"""The agent action is {action} and the tool call id: {tool_call["id"]}""")
-    response = tool_executor.invoke(action)
-    content = response.result
-    if "error" in response.context:
-      print(colored(f"""error: {response.context["error"]}""", "red"))
-      content = f"""error: {response.context["error"]}"""
-
-    tool_messages.append(ToolMessage(content=str(content), name=action.tool, tool_call_id=tool_call["id"]))
-
-  return {"messages": messages + tool_messages}
-
-def optimise_messages(state, llm, model):
+  try:
+    for i, tool_call in enumerate(tool_calls):
+      if i in skipped:
+        tool_messages.append(skipped[i])
+        continue
+
+      if tool_call["name"] == "update_data":
+        tool_message, context = execute(tool_call, state_input={"data_points": data_points})
+        data_points = context.get("data_points", data_points)
+      else:
+        tool_message, context = futures[i].result() if i in futures else execute(tool_call)
+      data_points = merge_tool_result(tool_call, tool_message, context, data_points, links_already_scraped)
+      tool_messages.append(tool_message)
+  finally:
+    if pool is not None:
+      pool.shutdown(wait=False)
+
+  return {"messages": tool_messages,
+          "data_points": data_points,
+          "links_already_scraped": links_already_scraped,
+          **usage_update(state, started, "", None, None)}
+
+async def acall_tool(state, tool_executor, reducer: Optional[ContentReducer] = None):
+  started = time.time()
   messages = state['messages']
-  system_prompt = messages[0].content
-  encoding = tiktoken.encoding_for_model(model)
+  tool_calls = messages[-1].tool_calls
+  data_points = state.get('data_points') or []
+  links_already_scraped = list(state.get('links_already_scraped') or [])
+  execute = partial(aexecute_tool_call, tool_executor=tool_executor, **tool_options(state, reducer))
+  skipped = skipped_tool_calls(tool_calls, links_already_scraped)
+
+  tasks = {i: asyncio.ensure_future(execute(tool_call)) for i, tool_call in enumerate(tool_calls)
+           if tool_call["name"] != "update_data" and i not in skipped}
+
+  tool_messages = []
+  for i, tool_call in enumerate(tool_calls):
+    if i in skipped:
+      tool_messages.append(skipped[i])
+      continue
 
-  token_count_messages = len(encoding.encode(str(messages)))
+    if tool_call["name"] == "update_data":
+      tool_message, context = await execute(tool_call, state_input={"data_points": data_points})
+      data_points = context.get("data_points", data_points)
+    else:
+      tool_message, context = await tasks[i]
+    data_points = merge_tool_result(tool_call, tool_message, context, data_points, links_already_scraped)
+    tool_messages.append(tool_message)
+
+  return {"messages": tool_messages,
+          "data_points": data_points,
+          "links_already_scraped": links_already_scraped,
+          **usage_update(state, started, "", None, None)}
+
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_TOKEN_THRESHOLD = int(os.getenv("SUMMARY_TOKEN_THRESHOLD", 4000))
+
+def summarizer_for(llm, model: str) -> Tuple[object, str]:
+  """
+  Returns the chat model and model name used for summaries: llm switched to the cheaper SUMMARY_MODEL
+  when it is an OpenAI chat model, otherwise llm itself.
+  """
+  if SUMMARY_MODEL and hasattr(llm, "model_name"):
+    return llm.copy(update={"model_name": SUMMARY_MODEL}), SUMMARY_MODEL
+  return llm, model
+
+def transcript(messages) -> str:
+  """
+  Renders messages compactly for the summarizer, leaving out what the state already keeps:
+  the system prompts, the previous summary and the data points saved through update_data.
+  """
+  lines = []
+  for message in messages:
+    if isinstance(message, SystemMessage) or (isinstance(message, ToolMessage) and message.name == "update_data"):
+      continue
+    if isinstance(message, ToolMessage):
+      lines.append(f"{message.name} result: {message.content}")
+    elif isinstance(message, HumanMessage):
+      lines.append(f"user: {message.content}")
+    else:
+      if message.content:
+        lines.append(f"assistant: {message.content}")
+      for tool_call in getattr(message, "tool_calls", None) or []:
+        if tool_call["name"] == "update_data":
+          lines.append(f"""assistant saved data points: {[dp.get("name") for dp in tool_call["args"].get("data_to_update", [])]}""")
+        else:
+          lines.append(f"""assistant called {tool_call["name"]}({tool_call["args"]})""")
+  return "\n".join(lines)
+
+def summary_request(messages, summary: str, model: str) -> Optional[Tuple[HumanMessage, list]]:
+  """
+  Returns the request folding the messages added since the last compaction into the rolling summary,
+  and the latest messages to keep, or None while the history is small enough.
+
+  Tokens are counted on the full content the model receives, and the summarizer reads it too.
+  """
+  token_count_messages = count_messages_tokens(materialize(messages), model)
   print(f"token count of messages: {token_count_messages} for {len(messages)} messages")
 
-  if token_count_messages > 4000 and len(messages) > 7:
-    latest_messages = messages [-5:]
-    
-    for message in latest_messages:
-      if isinstance(message, ToolMessage):
-        latest_messages = latest_messages[1:]
-      else:
-        break
-
-    index = messages.index(latest_messages[0])
-    early_messages = messages[:index]
-
-    token_count_latest_messages = len(encoding.encode(str(latest_messages) ))
-    print(f"token count of latest messages: {token_count_latest_messages}  for {len(latest_messages)} latest messages")
-
-    message = HumanMessage(content=f"""
-      Conversation History:
-      {early_messages}
-      -----
-      
-      The above text contains the entire conversation history between the user and the AI, including actions taken by the AI.
-      Please provide a concise summary of the key actions taken, important information learned, and tasks completed so far.
-      Exclude any redundant details and unnecessary scraped content. Focus on highlighting critical points, ensuring clarity, 
-      and retaining any information required by the AI assistant for ongoing tasks.
-
-      SUMMARY:""")
-    summary = ""
-    try:
-      response = llm.invoke([message])
-      summary = response.content
-      print(colored(f"summary: {summary}", "green"))
-    except Exception as e:
-      print(colored(f"error while optimising messages: {e}", "red"))
-      return {"messages": messages}
-    
-    system_message = SystemMessage(content=f"""
-      {system_prompt};
-      -------
-      Here is a summary of past actions taken so far:
-      {summary}
-      """)
-    
-    optimised_messages = [system_message] + latest_messages
-    print(f"token count of optimised messages: {len(encoding.encode(str(optimised_messages)))} for {len(optimised_messages)} optimised messages")
-    return {"messages": optimised_messages}
+  if token_count_messages <= SUMMARY_TOKEN_THRESHOLD or len(messages) <= 7:
+    return None
 
-  return {"messages": messages}
+  ### The latest messages start at a model turn at the earliest, never between its tool calls and their results,
+  ### however many tool calls that turn made
+  index = len(messages) - 5
+  while index > 0 and isinstance(messages[index], ToolMessage):
+    index -= 1
+  if all(isinstance(message, SystemMessage) for message in messages[:index]):
+    return None
 
+  latest_messages = messages[index:]
+  ### Everything before the latest messages except the system prompts was added since the last compaction
+  new_messages = messages[:index]
+
+  token_count_latest_messages = count_messages_tokens(materialize(latest_messages), model)
+  print(f"token count of latest messages: {token_count_latest_messages}  for {len(latest_messages)} latest messages")
+
+  message = HumanMessage(content=f"""
+    Summary so far:
+    {summary or "nothing yet"}
+    -----
+
+    New conversation since that summary:
+    {transcript(materialize(new_messages))}
+    -----
     
-      
-    
-      
-    
+    The above text contains the summary of the conversation between the user and the AI so far, followed by the actions taken since.
+    Please update the summary with the key actions taken, important information learned, and tasks completed in the new conversation.
+    Exclude any redundant details and unnecessary scraped content. Focus on highlighting critical points, ensuring clarity, 
+    and retaining any information required by the AI assistant for ongoing tasks, such as the urls already scraped.
+
+    UPDATED SUMMARY:""")
+  return message, latest_messages
+
+def summarised_messages(messages, latest_messages, summary: str, model: str) -> list:
+  """
+  Returns the original system prompt, the rolling summary as a second system message, and the latest messages,
+  replacing the history of the state.
+  """
+  summary_message = SystemMessage(content=f"""
+    Here is a summary of past actions taken so far:
+    {summary}
+    """)
+  
+  optimised_messages = ReplaceMessages([messages[0], summary_message] + latest_messages)
+  print(f"token count of optimised messages: {count_messages_tokens(materialize(optimised_messages), model)} for {len(optimised_messages)} optimised messages")
+  return optimised_messages
+
+def optimise_messages(state, llm, model, summary_model: str = ""):
+  started = time.time()
+  messages = state['messages']
+  summary_model = summary_model or model
+  request = summary_request(messages, state.get('summary') or "", model)
+  if request is None:
+    return {"messages": []}
+
+  message, latest_messages = request
+  try:
+    response = invoke_model(llm, [message], summary_model, stage="llm:summary")
+    print(colored(f"summary: {response.content}", "green"))
+  except Exception as e:
+    print(colored(f"error while optimising messages: {e}", "red"))
+    count("errors:summary")
+    return {"messages": []}
+
+  return {"messages": summarised_messages(messages, latest_messages, response.content, model), "summary": response.content,
+          **usage_update(state, started, summary_model, response, [message])}
+
+async def aoptimise_messages(state, llm, model, summary_model: str = ""):
+  started = time.time()
+  messages = state['messages']
+  summary_model = summary_model or model
+  request = await asyncio.to_thread(summary_request, messages, state.get('summary') or "", model)
+  if request is None:
+    return {"messages": []}
+
+  message, latest_messages = request
+  try:
+    response = await ainvoke_model(llm, [message], summary_model, stage="llm:summary")
+    print(colored(f"summary: {response.content}", "green"))
+  except Exception as e:
+    print(colored(f"error while optimising messages: {e}", "red"))
+    count("errors:summary")
+    return {"messages": []}
+
+  return {"messages": summarised_messages(messages, latest_messages, response.content, model), "summary": response.content,
+          **usage_update(state, started, summary_model, response, [message])}
@@ -1,40 +1,231 @@
+import asyncio
 import argparse
+from functools import partial
+from itertools import islice
 from termcolor import colored
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from internetsearch import internet_search
-import pandas as pd
 
-def get_filename():
+def get_arguments():
   parser = argparse.ArgumentParser(description='read arguments')
   parser.add_argument('-f', '--file', type=str, help='input file name')
-  
+  parser.add_argument('-o', '--output', type=str, default='./output.csv', help='output file name, .csv or .jsonl')
+  parser.add_argument('-w', '--workers', type=int, default=4, help='number of entities processed concurrently')
+  parser.add_argument('--async', dest='use_async', action='store_true', help='run entities as coroutines on one event loop instead of threads, -w sets how many are in flight')
+  parser.add_argument('--pipeline', action='store_true', help='read known websites first and search only for the data points still missing, -w sets the search workers')
+  parser.add_argument('--fetch-workers', type=int, default=16, help='number of websites fetched concurrently in --pipeline mode')
+  parser.add_argument('--website-workers', type=int, default=4, help='number of websites scraped by the model concurrently in --pipeline mode')
+  parser.add_argument('--batch-extract', type=int, default=0, help='in --pipeline mode, extract from the homepages of this many entities per model request before scraping them one by one')
+  parser.add_argument('--queue', type=str, help='job queue shared by a coordinator and workers, a SQLite file or sqlite:///path')
+  parser.add_argument('--coordinator', action='store_true', help='load the input file into --queue and write the results workers post back')
+  parser.add_argument('--worker', action='store_true', help='lease entities from --queue and process them, -w sets how many at a time')
+  parser.add_argument('--follow', action='store_true', help='keep a --worker waiting for new entities once the queue is drained')
+  parser.add_argument('--visibility-timeout', type=float, default=600, help='seconds a worker holds an entity without a heartbeat before it is leased again')
+  parser.add_argument('--max-attempts', type=int, default=3, help='attempts per entity in --queue mode before it is recorded as failed')
+  parser.add_argument('--chunksize', type=int, default=1000, help='number of input rows read at a time')
+  parser.add_argument('--flush-every', type=int, default=1, help='number of entities written between output flushes')
+  parser.add_argument('--journal', type=str, default='./journal.sqlite', help='journal file recording finished entities')
+  parser.add_argument('--resume', action='store_true', help='skip entities already finished in the journal and append to the output')
+  parser.add_argument('--checkpoint', action='store_true', help='checkpoint graph state so interrupted entities continue from their last node')
+  parser.add_argument('--min-coverage', type=float, help='fraction of data points found at which an entity stops, 1.0 by default')
+  parser.add_argument('--max-turns', type=int, help='maximum model turns per entity')
+  parser.add_argument('--max-tokens', type=int, help='maximum prompt and completion tokens per entity')
+  parser.add_argument('--max-seconds', type=float, help='maximum seconds spent per entity')
+  parser.add_argument('--max-cost', type=float, help='maximum estimated USD cost per entity')
+  parser.add_argument('--no-llm-cache', action='store_true', help='always call the model instead of replaying identical requests from the disk cache')
+  parser.add_argument('--serve', type=str, help='keep the model, graphs and encoder warm and serve searches over HTTP at host:port, -w sets the entities processed at a time')
+  parser.add_argument('--metrics', type=str, help='JSONL file receiving per entity timings, tokens and counters, summarized at the end of the run')
+
   args = parser.parse_args()
-  if args.file:
-    return args.file
-  else:
-    return input("Please enter the filename: ")
+  if (args.coordinator or args.worker) and not args.queue:
+    parser.error('--coordinator and --worker need --queue')
+  if not args.file and not args.worker and not args.serve:
+    args.file = input("Please enter the filename: ")
+  return args
 
 def main():
   load_dotenv()
   GPT_MODEL = "gpt-4o"
   data_points = ["Name", "Website", "Description", "Addresses", "Phone", "Email", "Founders", "CEO"]
-  llm = ChatOpenAI(model=GPT_MODEL, temperature=0, streaming=True)
 
-  filename = get_filename()
+  args = get_arguments()
+  ### Imported once the arguments are read, so --help and argument errors do not wait for pandas, langchain and langgraph
+  from internetsearch import internet_search, internet_search_async, search_tools
+  from records import open_writer, read_entities
+  from journal import Journal
+  from agent_nodes import GovernedChatOpenAI, default_budget
+  from batch import arun_batch, run_batch
+  from pipeline import Pipeline
+  from jobqueue import follow_results, open_queue, run_worker
+  from graph import compiled_workflow
+  from tokens import get_encoding
+  from tools import instrumentation
+  from tools.cache import LLMCache
+
+  ### temperature=0 requests are replayed from the disk cache when the model, tools and messages are identical,
+  ### and only the requests reaching the API take rate limit quota; retries are left to the rate limiter,
+  ### which would otherwise only see the 429s the client gave up on. Responses are not streamed: nothing reads
+  ### their tokens as they arrive, and streamed calls would go around the rate limiter
+  llm = GovernedChatOpenAI(model=GPT_MODEL, temperature=0, max_retries=0, cache=False if args.no_llm_cache else LLMCache())
+  journal = Journal(args.journal)
+  recorder = instrumentation.configure(args.metrics)
+  ### Async runs open their own checkpointer on the event loop, in run_async
+  checkpointer = journal.checkpointer() if args.checkpoint and not args.use_async else None
+  budget = default_budget()
+  for key in ["min_coverage", "max_turns", "max_tokens", "max_seconds", "max_cost"]:
+    if getattr(args, key) is not None:
+      budget[key] = getattr(args, key)
+
+  def entity_options(row):
+    website = row.get('Website')
+    return {"checkpointer": checkpointer, "thread_id": Journal.job_key(row['Entity'], data_points), "resume": args.resume,
+            "website": website if isinstance(website, str) and website.strip() else None, "budget": budget}
+
+  def search(row):
+    options = entity_options(row)
+    journal.mark_started(options["thread_id"], row['Entity'], data_points)
+    try:
+      with instrumentation.entity_run(row['Entity']):
+        output = internet_search(llm, GPT_MODEL, row['Entity'], data_points, **options)
+    except Exception as e:
+      journal.mark_failed(options["thread_id"], row['Entity'], data_points, str(e))
+      raise
+    return output
+
+  async def asearch(row, saver=None):
+    options = {**entity_options(row), "checkpointer": saver}
+    journal.mark_started(options["thread_id"], row['Entity'], data_points)
+    try:
+      with instrumentation.entity_run(row['Entity']):
+        output = await internet_search_async(llm, GPT_MODEL, row['Entity'], data_points, **options)
+    except Exception as e:
+      journal.mark_failed(options["thread_id"], row['Entity'], data_points, str(e))
+      raise
+    return output
+
+  def pending_rows():
+    for row in read_entities(args.file, args.chunksize):
+      if args.resume and journal.is_done(Journal.job_key(row['Entity'], data_points)):
+        continue
+      yield row
+
+  def finish(row, output, error):
+    key = Journal.job_key(row['Entity'], data_points)
+    if error is not None:
+      journal.mark_failed(key, row['Entity'], data_points, str(error))
+    else:
+      journal.mark_done(key, row['Entity'], data_points, output)
+
+  ### Entities are journaled as done only once their records are flushed to the output,
+  ### so --resume never skips an entity whose record a crash kept out of the file
+  unflushed = []
+
+  def flush_journal():
+    for row, output, error in unflushed:
+      finish(row, output, error)
+    unflushed.clear()
+
+  def write(writer, row, output, error):
+    if error is not None:
+      print(colored(f"""skipping {row['Entity']}: {error}""", "red"))
+    writer.write(row['Entity'], output["data_points"] if output else None, error)
+    unflushed.append((row, output, error))
+    if writer.pending == 0:
+      flush_journal()
+
+  def work(row):
+    ### Workers post results to the queue, which keeps them durably
+    output = search(row)
+    finish(row, output, None)
+    return output
+
+  def run_pipeline(writer):
+    pipeline = Pipeline(llm, GPT_MODEL, data_points, fetch_workers=args.fetch_workers, website_workers=args.website_workers,
+                        search_workers=args.workers, budget=budget, batch_size=args.batch_extract)
+    for row, output, error in pipeline.run(pending_rows()):
+      write(writer, row, output, error)
+
+  def run_coordinator(writer, queue):
+    rows = read_entities(args.file, args.chunksize)
+    while True:
+      chunk = list(islice(rows, args.chunksize))
+      if not chunk:
+        break
+      queue.enqueue((Journal.job_key(row['Entity'], data_points), row) for row in chunk)
+    print(f"queued entities: {queue.counts()}")
+    ### The queue keeps how far the output got, so a resumed coordinator appends only the results it never wrote
+    written = queue.cursor("coordinator") if args.resume else 0
+    try:
+      for job in follow_results(queue, after=written):
+        write(writer, job["payload"], job["result"], job["error"] if job["status"] == "failed" else None)
+        written = job["seq"]
+        if writer.pending == 0:
+          queue.set_cursor("coordinator", written)
+    finally:
+      writer.flush()
+      queue.set_cursor("coordinator", written)
+
+  async def run_async(writer):
+    async def run(saver):
+      async for row, output, error in arun_batch(partial(asearch, saver=saver), pending_rows(), concurrency=args.workers):
+        write(writer, row, output, error)
+
+    if not args.checkpoint:
+      await run(None)
+      return
+    async with journal.async_checkpointer() as saver:
+      await run(saver)
+
+  if args.serve:
+    from service import serve
+    def warm():
+      get_encoding(GPT_MODEL)
+      compiled_workflow("internet_search", llm, GPT_MODEL, search_tools, checkpointer=checkpointer, budget=budget)
+    try:
+      serve(args.serve, search, workers=args.workers, chunksize=args.chunksize, warm=warm)
+    finally:
+      journal.close()
+      if recorder is not None:
+        recorder.close()
+        print(recorder.summary())
+    return
+
+  if args.worker:
+    queue = open_queue(args.queue, max_attempts=args.max_attempts)
+    try:
+      run_worker(queue, work, workers=args.workers, visibility_timeout=args.visibility_timeout, follow=args.follow)
+    finally:
+      queue.close()
+      journal.close()
+      if recorder is not None:
+        recorder.close()
+        print(recorder.summary())
+    return
+
   try:
-    df = pd.read_csv(filename, header = 0)
-    output_df = pd.DataFrame(columns=data_points)
-    for _, row in df.iterrows():
-      output = internet_search(llm, GPT_MODEL, row['Entity'], data_points)
-      row_data = {}
-      for dp in output["data_points"]:
-        row_data[dp["name"]] = dp["value"]
-      output_df = pd.concat([output_df, pd.DataFrame([row_data])], ignore_index=True) 
-    output_df.to_csv('./output.csv')
+    with open_writer(args.output, data_points, append=args.resume, flush_every=args.flush_every) as writer:
+      if args.coordinator:
+        queue = open_queue(args.queue, max_attempts=args.max_attempts)
+        try:
+          run_coordinator(writer, queue)
+        finally:
+          queue.close()
+      elif args.pipeline:
+        run_pipeline(writer)
+      elif args.use_async:
+        asyncio.run(run_async(writer))
+      else:
+        for row, output, error in run_batch(search, pending_rows(), workers=args.workers):
+          write(writer, row, output, error)
   except Exception as e:
       print(colored(f"error while processing file: {e}", "red"))
       return
+  finally:
+    ### The writer is closed, so the records still waiting for a flush are on disk
+    flush_journal()
+    journal.close()
+    if recorder is not None:
+      recorder.close()
+      print(recorder.summary())
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
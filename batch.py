@@ -0,0 +1,76 @@
+import asyncio
+from collections import deque
+from termcolor import colored
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional, Tuple
+
+def process_safely(process: Callable[[Any], Any], item: Any) -> Tuple[Any, Optional[Exception]]:
+  """
+  Runs process on a single item, returning the error instead of raising so one
+  failing entity does not abort the rest of the batch.
+  """
+  try:
+    return process(item), None
+  except Exception as e:
+    print(colored(f"error while processing {item}: {e}", "red"))
+    return None, e
+
+def run_batch(process: Callable[[Any], Any], items: Iterable[Any], workers: int = 4) -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+  """
+  Runs process over items on a pool of worker threads.
+
+  Args:
+      process (Callable): The function to run for every item.
+      items (Iterable): The items to process, consumed lazily.
+      workers (int): The number of items in flight at the same time.
+
+  Returns:
+      Iterator: (item, result, error) tuples in input order.
+  """
+  workers = max(1, workers)
+  window = workers * 2
+  pending = deque()
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    for item in items:
+      pending.append((item, executor.submit(process_safely, process, item)))
+      if len(pending) >= window:
+        item, future = pending.popleft()
+        yield (item, *future.result())
+
+    while pending:
+      item, future = pending.popleft()
+      yield (item, *future.result())
+
+async def aprocess_safely(process: Callable[[Any], Awaitable[Any]], item: Any, semaphore: asyncio.Semaphore) -> Tuple[Any, Optional[Exception]]:
+  async with semaphore:
+    try:
+      return await process(item), None
+    except Exception as e:
+      print(colored(f"error while processing {item}: {e}", "red"))
+      return None, e
+
+async def arun_batch(process: Callable[[Any], Awaitable[Any]], items: Iterable[Any], concurrency: int = 100) -> AsyncIterator[Tuple[Any, Any, Optional[Exception]]]:
+  """
+  Runs the coroutine function process over items on the running event loop.
+
+  Args:
+      process (Callable): The coroutine function to run for every item.
+      items (Iterable): The items to process, consumed lazily.
+      concurrency (int): The number of items in flight at the same time.
+
+  Returns:
+      AsyncIterator: (item, result, error) tuples in input order.
+  """
+  concurrency = max(1, concurrency)
+  semaphore = asyncio.Semaphore(concurrency)
+  window = concurrency * 2
+  pending = deque()
+  for item in items:
+    pending.append((item, asyncio.ensure_future(aprocess_safely(process, item, semaphore))))
+    if len(pending) >= window:
+      item, task = pending.popleft()
+      yield (item, *(await task))
+
+  while pending:
+    item, task = pending.popleft()
+    yield (item, *(await task))
@@ -0,0 +1,235 @@
+import json
+import time
+import uuid
+import threading
+from termcolor import colored
+from typing import Dict, List, Optional, TypedDict
+from langchain_core.messages import HumanMessage, SystemMessage, convert_to_messages
+from agent_nodes import invoke_model
+from batch import run_batch
+from tokens import get_encoding
+from tools.custom import UpdateDataTool
+
+### Tokens of scraped content packed into one request, and kept at most per entity
+BATCH_MAX_TOKENS = 60000
+BATCH_ITEM_MAX_TOKENS = 6000
+
+class BatchItem(TypedDict):
+  id: str
+  entity: str
+  data_points: List[dict]
+  pages: List[dict]
+
+SYSTEM_PROMPT = """
+  You are a world class researcher extracting data points about several entities at once.
+  Each entity comes with its id, the data points still missing and pages scraped from the internet.
+  For every entity, report each missing data point with its value and the url it was found on,
+  using only the pages given for that entity; use null when a page does not state it. Do not make things up.
+"""
+
+def extraction_schema(data_points: List[str]) -> dict:
+  """
+  Returns the strict JSON schema of a batch extraction answer over data_points.
+  """
+  data_point = {
+    "type": "object",
+    "properties": {
+      "name": {"type": "string", "enum": data_points},
+      "value": {"type": ["string", "null"]},
+      "reference": {"type": ["string", "null"]},
+    },
+    "required": ["name", "value", "reference"],
+    "additionalProperties": False,
+  }
+  entity = {
+    "type": "object",
+    "properties": {"id": {"type": "string"}, "data_points": {"type": "array", "items": data_point}},
+    "required": ["id", "data_points"],
+    "additionalProperties": False,
+  }
+  return {
+    "type": "object",
+    "properties": {"entities": {"type": "array", "items": entity}},
+    "required": ["entities"],
+    "additionalProperties": False,
+  }
+
+def response_format(data_points: List[str]) -> dict:
+  return {"type": "json_schema", "json_schema": {"name": "batch_extraction", "strict": True, "schema": extraction_schema(data_points)}}
+
+def missing(item: BatchItem) -> List[str]:
+  return [dp["name"] for dp in item["data_points"] if dp["value"] is None]
+
+def item_text(item: BatchItem, model: str, max_tokens: int = BATCH_ITEM_MAX_TOKENS) -> str:
+  """
+  Renders an entity for the request, cutting its pages to max_tokens.
+  """
+  encoding = get_encoding(model)
+  text = f"""
+    id: {item["id"]}
+    entity: {item["entity"]}
+    missing data points: {missing(item)}
+  """
+  for page in item["pages"]:
+    text += f"""
+    page: {page["url"]}
+    {page["content"]}
+    -----
+    """
+  tokens = encoding.encode(text)
+  return encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+
+def pack(items: List[BatchItem], model: str, max_tokens: int = BATCH_MAX_TOKENS) -> List[List[BatchItem]]:
+  """
+  Groups items into batches whose rendered content stays within max_tokens, keeping their order.
+  """
+  encoding = get_encoding(model)
+  batches, batch, size = [], [], 0
+  for item in items:
+    tokens = len(encoding.encode(item_text(item, model)))
+    if batch and size + tokens > max_tokens:
+      batches.append(batch)
+      batch, size = [], 0
+    batch.append(item)
+    size += tokens
+  if batch:
+    batches.append(batch)
+  return batches
+
+def batch_messages(batch: List[BatchItem], model: str) -> list:
+  entities = "\n".join(item_text(item, model) for item in batch)
+  return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=f"""
+    Entities:
+    {entities}
+
+    Answer with one entry per entity id above.
+  """)]
+
+def apply_answer(batch: List[BatchItem], content: str) -> Dict[str, List[dict]]:
+  """
+  Splits a batch answer back into each entity's data points, saved through UpdateDataTool.
+
+  Returns:
+      Dict: The updated data points by item id; items missing from the answer keep theirs.
+  """
+  update_data = UpdateDataTool()
+  answers = {entity["id"]: entity["data_points"] for entity in json.loads(content).get("entities", [])}
+  updated = {}
+  for item in batch:
+    wanted = missing(item)
+    found = [dp for dp in answers.get(item["id"], []) if dp["name"] in wanted and dp["value"]]
+    updated[item["id"]] = item["data_points"]
+    if found:
+      response = update_data.invoke({"data_to_update": found, "data_points": item["data_points"]})
+      updated[item["id"]] = response.context.get("data_points", item["data_points"])
+  return updated
+
+def extract_batch(llm, model: str, batch: List[BatchItem]) -> Dict[str, List[dict]]:
+  """
+  Extracts the missing data points of every entity of batch with one structured-output request.
+  """
+  names = sorted({name for item in batch for name in missing(item)})
+  if not names:
+    return {item["id"]: item["data_points"] for item in batch}
+  messages = batch_messages(batch, model)
+  response = invoke_model(llm.bind(response_format=response_format(names)), messages, model, stage="llm:batch_extract")
+  return apply_answer(batch, response.content)
+
+def batch_extract(llm, model: str, items: List[BatchItem], max_tokens: int = BATCH_MAX_TOKENS, workers: int = 4, queue: Optional["LocalBatchQueue"] = None) -> Dict[str, List[dict]]:
+  """
+  Extracts the missing data points of many entities, several entities per request.
+
+  Args:
+      llm: The chat model, without tools bound.
+      model (str): The model name.
+      items (List[BatchItem]): The entities with their data points and scraped pages.
+      max_tokens (int): The tokens of content packed into one request.
+      workers (int): The requests in flight when calling the model directly.
+      queue (LocalBatchQueue): Submits the requests to an offline batch queue instead of calling the model.
+
+  Returns:
+      Dict: The updated data points by item id.
+  """
+  batches = pack(items, model, max_tokens)
+  updated = {}
+  if queue is not None:
+    requests = [batch_request(f"batch-{i}", batch, model) for i, batch in enumerate(batches)]
+    results = {result["custom_id"]: result for result in queue.wait(queue.submit(requests))}
+    for i, batch in enumerate(batches):
+      result = results.get(f"batch-{i}") or {}
+      if result.get("error"):
+        print(colored(f"""error in batch extraction request batch-{i}: {result["error"]}""", "red"))
+        updated.update({item["id"]: item["data_points"] for item in batch})
+        continue
+      updated.update(apply_answer(batch, result["response"]["body"]["choices"][0]["message"]["content"]))
+    return updated
+
+  for batch, result, error in run_batch(lambda batch: extract_batch(llm, model, batch), batches, workers=workers):
+    updated.update(result if error is None else {item["id"]: item["data_points"] for item in batch})
+  return updated
+
+def batch_request(custom_id: str, batch: List[BatchItem], model: str) -> dict:
+  """
+  Returns the request of batch in the JSONL line format of the OpenAI batch API.
+  """
+  roles = {"system": "system", "human": "user"}
+  messages = [{"role": roles[message.type], "content": message.content} for message in batch_messages(batch, model)]
+  names = sorted({name for item in batch for name in missing(item)})
+  return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+          "body": {"model": model, "messages": messages, "temperature": 0, "response_format": response_format(names)}}
+
+class LocalBatchQueue:
+  """
+  Local stand-in for an offline batch API, for testing batch extraction without uploading files.
+
+  Requests in the OpenAI batch JSONL format run on a background thread against llm, and results come
+  back in the batch output format, one per custom_id.
+
+  Args:
+      llm: The chat model answering the requests.
+      workers (int): The requests run concurrently.
+  """
+
+  def __init__(self, llm, workers: int = 4):
+    self.llm = llm
+    self.workers = workers
+    self.batches: Dict[str, dict] = {}
+    self.lock = threading.Lock()
+
+  def submit(self, requests: List[dict]) -> str:
+    batch_id = f"batch_{uuid.uuid4().hex}"
+    with self.lock:
+      self.batches[batch_id] = {"status": "in_progress", "results": []}
+    threading.Thread(target=self._process, args=(batch_id, requests), name=batch_id, daemon=True).start()
+    return batch_id
+
+  def _answer(self, request: dict) -> dict:
+    body = request["body"]
+    response = invoke_model(self.llm.bind(response_format=body["response_format"]), convert_to_messages(body["messages"]), body["model"], stage="llm:batch_extract")
+    return {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": response.content}}]}}
+
+  def _process(self, batch_id: str, requests: List[dict]):
+    results = []
+    for request, response, error in run_batch(self._answer, requests, workers=self.workers):
+      results.append({"custom_id": request["custom_id"], "response": response, "error": str(error) if error is not None else None})
+    with self.lock:
+      self.batches[batch_id] = {"status": "completed", "results": results}
+
+  def status(self, batch_id: str) -> str:
+    with self.lock:
+      return self.batches[batch_id]["status"]
+
+  def results(self, batch_id: str) -> List[dict]:
+    with self.lock:
+      return list(self.batches[batch_id]["results"])
+
+  def wait(self, batch_id: str, poll: float = 1.0, timeout: Optional[float] = None) -> List[dict]:
+    """
+    Polls until the batch completes and returns its results.
+    """
+    started = time.time()
+    while self.status(batch_id) != "completed":
+      if timeout is not None and time.time() - started > timeout:
+        raise TimeoutError(f"batch {batch_id} did not complete in {timeout} seconds")
+      time.sleep(poll)
+    return self.results(batch_id)
@@ -0,0 +1,190 @@
+import re
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from typing import Any, List, Optional, Type
+from langchain_core.tools import BaseTool
+from langchain_core.pydantic_v1 import BaseModel
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+import internetsearch
+import websitescrap
+from batch import arun_batch, run_batch
+from tools import instrumentation
+from tools.custom import UpdateDataTool, update_data_definition
+from tools.utils import ScrapeInput, SearchInput, ToolResponse
+
+ENTITY_PATTERN = re.compile(r"(?:entity_to_search|Entity name)\s*:\s*(.+)")
+CALL_ID_PATTERN = re.compile(r"call_(\d+)_")
+
+def payload(title: str, size: int) -> str:
+  """
+  Returns a markdown page of about size bytes, made of distinct paragraphs so reduction has real work to do.
+  """
+  blocks = [f"# {title}"]
+  length = len(blocks[0])
+  i = 0
+  while length < size:
+    block = f"Paragraph {i} about {title}: the company offers services number {i} to customers in region {i % 7} and lists office {i} on this page."
+    blocks.append(block)
+    length += len(block) + 2
+    i += 1
+  return "\n\n".join(blocks)
+
+class ScriptedChatModel(BaseChatModel):
+  """
+  Chat model replaying a fixed script of tool calls, so graphs run without the OpenAI API.
+
+  Each entity gets turns - 1 turns of one search, unless search is off for graphs without the
+  search tool, and scrapes_per_turn scrapes of distinct urls, then one update_data turn saving
+  every data point; summarization requests get a short summary.
+  """
+  data_points: List[str] = []
+  turns: int = 4
+  scrapes_per_turn: int = 2
+  latency: float = 0.0
+  search: bool = True
+
+  @property
+  def _llm_type(self) -> str:
+    return "scripted"
+
+  def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+    time.sleep(self.latency)
+    return ChatResult(generations=[ChatGeneration(message=self.respond(messages))])
+
+  async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs) -> ChatResult:
+    await asyncio.sleep(self.latency)
+    return ChatResult(generations=[ChatGeneration(message=self.respond(messages))])
+
+  def respond(self, messages: List[BaseMessage]) -> AIMessage:
+    texts = [str(message.content) for message in messages] + [message.tool_call_id for message in messages if isinstance(message, ToolMessage)]
+    entities = [match.group(1).strip() for text in texts for match in ENTITY_PATTERN.finditer(text)]
+    entity = entities[0] if entities else "entity"
+    turn = max([int(turn) + 1 for text in texts for turn in CALL_ID_PATTERN.findall(text)], default=0)
+
+    ### The summarizer is the only caller without a system prompt
+    if not any(isinstance(message, SystemMessage) for message in messages):
+      return AIMessage(content=f"Summary of entity_to_search : {entity}, searched and scraped up to call_{turn - 1}_0.")
+
+    slug = re.sub(r"[^a-z0-9]+", "-", entity.lower()).strip("-")
+    if turn < self.turns - 1:
+      calls = [("search", {"query": f"{entity} {' '.join(self.data_points)} {turn}"})] if self.search else []
+      calls += [("scrape", {"url": f"https://{slug}.example/page-{turn}-{k}"}) for k in range(self.scrapes_per_turn)]
+    elif turn == self.turns - 1:
+      calls = [("update_data", {"data_to_update": [{"name": dp, "value": f"{dp} of {entity}", "reference": f"https://{slug}.example"} for dp in self.data_points]})]
+    else:
+      return AIMessage(content=f"All data points of {entity} are found.")
+
+    tool_calls = [{"name": name, "args": args, "id": f"call_{turn}_{k}"} for k, (name, args) in enumerate(calls)]
+    openai_calls = [{"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": json.dumps(call["args"])}} for call in tool_calls]
+    return AIMessage(content="", tool_calls=tool_calls, additional_kwargs={"tool_calls": openai_calls})
+
+class StubScrapeTool(BaseTool):
+  name = "scrape"
+  description = "Returns a generated page of payload_bytes for any url after latency seconds."
+  args_schema: Type[BaseModel] = ScrapeInput
+  return_direct: bool = True
+  latency: float = 0.0
+  payload_bytes: int = 20000
+
+  def _run(self, url: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> ToolResponse:
+    time.sleep(self.latency)
+    return ToolResponse(result=payload(url, self.payload_bytes), context={})
+
+  async def _arun(self, url: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+    await asyncio.sleep(self.latency)
+    return ToolResponse(result=payload(url, self.payload_bytes), context={})
+
+class StubSearchTool(BaseTool):
+  name = "search"
+  description = "Returns generated search results of payload_bytes for any query after latency seconds."
+  args_schema: Type[BaseModel] = SearchInput
+  return_direct: bool = True
+  latency: float = 0.0
+  payload_bytes: int = 2000
+
+  def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> ToolResponse:
+    time.sleep(self.latency)
+    return ToolResponse(result=payload(query, self.payload_bytes), context={})
+
+  async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+    await asyncio.sleep(self.latency)
+    return ToolResponse(result=payload(query, self.payload_bytes), context={})
+
+def get_arguments():
+  parser = argparse.ArgumentParser(description='offline benchmark of the search graphs with a scripted model and stub tools')
+  parser.add_argument('--graph', choices=['internet_search', 'website_scrap'], default='internet_search', help='graph to drive')
+  parser.add_argument('-n', '--entities', type=int, default=20, help='number of entities')
+  parser.add_argument('-w', '--workers', type=int, default=4, help='number of entities processed concurrently')
+  parser.add_argument('--async', dest='use_async', action='store_true', help='run internet_search entities as coroutines')
+  parser.add_argument('--turns', type=int, default=4, help='model turns per entity, the last one saving the data points')
+  parser.add_argument('--scrapes-per-turn', type=int, default=2, help='scrape calls per model turn')
+  parser.add_argument('--llm-latency', type=float, default=0.05, help='seconds per model call')
+  parser.add_argument('--tool-latency', type=float, default=0.1, help='seconds per search or scrape')
+  parser.add_argument('--scrape-bytes', type=int, default=20000, help='size of every scraped page')
+  parser.add_argument('--search-bytes', type=int, default=2000, help='size of every search result')
+  parser.add_argument('--metrics', type=str, help='JSONL file receiving the per entity metrics, a temporary file by default')
+  return parser.parse_args()
+
+def main():
+  args = get_arguments()
+  model = "gpt-4o"
+  data_points = ["Name", "Website", "Description", "Addresses", "Phone", "Email", "Founders", "CEO"]
+  llm = ScriptedChatModel(data_points=data_points, turns=args.turns, scrapes_per_turn=args.scrapes_per_turn, latency=args.llm_latency,
+                           search=args.graph == "internet_search")
+  scrape = StubScrapeTool(latency=args.tool_latency, payload_bytes=args.scrape_bytes)
+  search = StubSearchTool(latency=args.tool_latency, payload_bytes=args.search_bytes)
+  internetsearch.search_tools = lambda: ([UpdateDataTool(), search, scrape], [update_data_definition, search, scrape])
+  websitescrap.scrape_tools = lambda: ([UpdateDataTool(), scrape], [update_data_definition, scrape])
+
+  metrics_path = args.metrics or tempfile.NamedTemporaryFile(prefix="benchmark-", suffix=".jsonl", delete=False).name
+  recorder = instrumentation.configure(metrics_path)
+  entities = [f"Entity {i}" for i in range(args.entities)]
+
+  def process(entity):
+    with instrumentation.entity_run(entity):
+      if args.graph == "website_scrap":
+        slug = entity.lower().replace(" ", "-")
+        return websitescrap.website_scrap(llm, model, [f"https://{slug}.example"], entity, data_points, [])
+      return internetsearch.internet_search(llm, model, entity, data_points)
+
+  async def aprocess(entity):
+    with instrumentation.entity_run(entity):
+      return await internetsearch.internet_search_async(llm, model, entity, data_points)
+
+  async def run_async():
+    return [result async for result in arun_batch(aprocess, entities, concurrency=args.workers)]
+
+  tracemalloc.start()
+  started = time.perf_counter()
+  if args.use_async and args.graph == "internet_search":
+    results = asyncio.run(run_async())
+  else:
+    results = list(run_batch(process, entities, workers=args.workers))
+  elapsed = time.perf_counter() - started
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  recorder.close()
+
+  errors = sum(1 for _, _, error in results if error is not None)
+  complete = sum(1 for _, output, _ in results if output and all(dp["value"] is not None for dp in output["data_points"]))
+  ### Nodes catch model, tool and workflow errors to keep entities going, so a run can finish fast having done nothing
+  node_errors = {name: value for name, value in recorder.counters.items() if name.startswith("errors:")}
+  print(f"""
+    graph: {args.graph}, {'async' if args.use_async else 'threads'}, workers: {args.workers}
+    entities: {len(results)}, complete: {complete}, errors: {errors}, node errors: {sum(node_errors.values())} {node_errors or ""}
+    seconds: {elapsed:.2f}, entities/sec: {len(results) / elapsed:.2f}
+    peak traced memory: {peak / 1024 / 1024:.1f} MB
+    summarized prompt tokens: {recorder.totals["llm:summary"].get("prompt_tokens", 0):.0f}
+    metrics: {metrics_path}
+  """)
+  print(recorder.summary())
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,181 @@
+import re
+import json
+from termcolor import colored
+from urllib.parse import urljoin
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from tools import http_client
+from tools.frontier import get_frontier
+from tools.utils import url_domain
+
+EMAIL = re.compile(r"(?<![\w.+-])[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,24}(?![\w-])")
+MAILTO = re.compile(r"mailto:([^\s)\"'<>?]+)", re.I)
+### Numbers stay on one line and labels are whole words, so "graph 2019 - 2023" or "Hotel 2019-2023" are not phones
+TEL = re.compile(r"tel:(\+?[\d \t().-]{6,}\d)", re.I)
+LABELLED_PHONE = re.compile(r"\b(?:phone|tel|telephone|mobile|call us|ph)\b[ \t]*[.:\-]?[ \t]*(?:\*\*)?[ \t]*(\+?\d[\d \t().-]{6,}\d)", re.I)
+JSON_LD = re.compile(r"<script[^>]+application/ld\+json[^>]*>(.*?)</script>", re.S | re.I)
+SCRIPT = re.compile(r"<(script|style)\b[^>]*>.*?</\1\s*>", re.S | re.I)
+CONTACT_LINK = re.compile(r"""href=["']([^"']*contact[^"']*)["']""", re.I)
+FILE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".js", ".mjs", ".css", ".map")
+### Error reporting DSNs and bundler package names look like emails in page scripts and configs
+TELEMETRY_DOMAINS = ("sentry.io", "wixpress.com", "bugsnag.com", "datadoghq.com", "example.com")
+ORGANIZATION_TYPES = {"organization", "corporation", "localbusiness", "onlinebusiness", "ngo", "educationalorganization"}
+MAX_VALUES = 3
+### Second-level labels that country code domains register names under, as in co.uk, com.au or ac.jp
+SECOND_LEVEL_SUFFIXES = {"co", "com", "net", "org", "gov", "edu", "ac", "or", "ne", "go", "gob", "nic", "mil", "ltd", "plc"}
+
+def unique(values: Iterable[str], key=str.lower) -> List[str]:
+  seen = {}
+  for value in values:
+    value = value.strip()
+    if value and key(value) not in seen:
+      seen[key(value)] = value
+  return list(seen.values())[:MAX_VALUES]
+
+def digits(phone: str) -> str:
+  return re.sub(r"\D", "", phone)
+
+def is_email(email: str) -> bool:
+  email = email.lower()
+  domain = email.rsplit("@", 1)[-1]
+  return not email.endswith(FILE_SUFFIXES) and not any(domain == host or domain.endswith("." + host) for host in TELEMETRY_DOMAINS)
+
+def find_emails(content: str) -> List[str]:
+  emails = MAILTO.findall(content) + EMAIL.findall(content)
+  return unique(email for email in emails if is_email(email))
+
+def find_phones(content: str) -> List[str]:
+  phones = TEL.findall(content) + LABELLED_PHONE.findall(content)
+  ### Keeping numbers with enough digits to be dialled, once whatever their formatting
+  return unique((" ".join(phone.split()) for phone in phones if 7 <= len(digits(phone)) <= 15), key=digits)
+
+def iter_json_ld(content: str) -> Iterable[Dict[str, Any]]:
+  for block in JSON_LD.findall(content):
+    try:
+      data = json.loads(block.strip())
+    except ValueError:
+      continue
+    stack = [data]
+    while stack:
+      item = stack.pop()
+      if isinstance(item, list):
+        stack.extend(item)
+      elif isinstance(item, dict):
+        stack.extend(item.get("@graph", []))
+        yield item
+
+def find_organization(content: str) -> Optional[Dict[str, Any]]:
+  for item in iter_json_ld(content):
+    types = item.get("@type", [])
+    types = types if isinstance(types, list) else [types]
+    if any(str(t).lower() in ORGANIZATION_TYPES for t in types):
+      return item
+  return None
+
+def format_address(address: Any) -> str:
+  if isinstance(address, list):
+    return "; ".join(format_address(a) for a in address)
+  if isinstance(address, dict):
+    parts = [address.get(key) for key in ["streetAddress", "addressLocality", "addressRegion", "postalCode", "addressCountry"]]
+    parts = [part.get("name", "") if isinstance(part, dict) else part for part in parts]
+    return ", ".join(str(part) for part in parts if part)
+  return str(address or "")
+
+def format_people(people: Any) -> str:
+  people = people if isinstance(people, list) else [people]
+  return "; ".join(person.get("name", "") if isinstance(person, dict) else str(person) for person in people if person)
+
+def matching(data_points: Iterable[str], keyword: str) -> List[str]:
+  return [dp for dp in data_points if keyword in dp.lower()]
+
+def extract_data_points(content: str, url: str, data_points: Iterable[str]) -> List[dict]:
+  """
+  Extracts data points from a page without the LLM, from schema.org Organization blocks,
+  mailto:/tel: links and email and phone patterns.
+
+  Args:
+      content (str): The page content, HTML or markdown.
+      url (str): The page URL, saved as the reference.
+      data_points (Iterable[str]): The names of the data points to extract.
+
+  Returns:
+      List[dict]: The data points found, in the update_data format [{"name": "xxx", "value": "yyy", "reference": "url"}].
+  """
+  data_points = list(data_points)
+  found = {}
+  organization = find_organization(content) or {}
+  ### Patterns only read the page outside its scripts and styles, once the JSON-LD blocks were parsed
+  text = SCRIPT.sub(" ", content)
+  fields = {
+    "name": organization.get("legalName") or organization.get("name"),
+    "website": organization.get("url"),
+    "description": organization.get("description"),
+    "address": format_address(organization.get("address")),
+    "founder": format_people(organization.get("founder") or organization.get("founders") or []),
+    "email": "; ".join(unique([str(organization.get("email") or "").replace("mailto:", "")] + find_emails(text))),
+    "phone": "; ".join(unique([str(organization.get("telephone") or "")] + find_phones(text), key=digits)),
+  }
+  for keyword, value in fields.items():
+    if not value:
+      continue
+    for dp in matching(data_points, keyword):
+      found.setdefault(dp, value)
+  return [{"name": name, "value": value, "reference": url} for name, value in found.items()]
+
+def registrable_label(url: str) -> str:
+  """
+  Returns the label a domain is registered under, such as "acme" for shop.acme.co.uk.
+  """
+  labels = url_domain(url).split(":")[0].split(".")
+  if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_SUFFIXES:
+    return labels[-3]
+  return labels[-2] if len(labels) >= 2 else labels[0]
+
+def on_entity_domain(url: str, entity_name: str) -> bool:
+  """
+  Tells whether url is served from the entity's own domain, judged by its name, so contact details
+  listed on directories and news pages are not taken for the entity's own.
+  """
+  words = re.findall(r"[a-z0-9]+", (entity_name or "").lower())
+  name = "".join(words)
+  label = re.sub(r"[^a-z0-9]", "", registrable_label(url).lower())
+  ### Short brand domains such as hp.com match the first word or the initials of the name only
+  if label and words and label in (words[0], "".join(word[0] for word in words)):
+    return True
+  return len(label) >= 3 and len(name) >= 3 and (label in name or name in label)
+
+def prefill_data_points(data_points: List[dict], extracted: List[dict]) -> Tuple[List[dict], List[dict]]:
+  """
+  Fills the data points that are still missing with the extracted values.
+
+  Returns:
+      Tuple[List[dict], List[dict]]: The updated data points and the extracted data points that were saved.
+  """
+  missing = [dp["name"] for dp in data_points if dp["value"] is None]
+  to_update = {dp["name"]: dp for dp in extracted if dp["name"] in missing}
+  updated = [dict(dp, value=to_update[dp["name"]]["value"], reference=to_update[dp["name"]]["reference"]) if dp["name"] in to_update else dp for dp in data_points]
+  return updated, list(to_update.values())
+
+def extract_from_website(website: str, data_points: Iterable[str]) -> List[dict]:
+  """
+  Fetches the homepage of a known website, and its contact page when linked, and extracts data points from their HTML.
+  """
+  data_points = list(data_points)
+  url = website if "://" in website else "https://" + website
+  found = {dp: {"name": dp, "value": url, "reference": url} for dp in matching(data_points, "website")}
+  pages = [url]
+  while pages:
+    page = pages.pop(0)
+    try:
+      response = get_frontier().fetch(page, lambda page=page: http_client.get(page), kind="website")
+    except Exception as e:
+      print(colored(f"error while fetching {page}: {e}", "red"))
+      continue
+    if not response.ok:
+      continue
+    for dp in extract_data_points(response.text, page, data_points):
+      found.setdefault(dp["name"], dp)
+    if page == url:
+      contact = CONTACT_LINK.search(response.text)
+      if contact:
+        pages.append(urljoin(url, contact.group(1)))
+  return list(found.values())
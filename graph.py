@@ -1,23 +1,82 @@
+import json
+import threading
 from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
 from langgraph.graph import StateGraph, END
 from langgraph.graph.graph import CompiledGraph
 from langgraph.prebuilt.tool_executor import ToolExecutor
-from agent_nodes import AgentState, call_model, call_tool, optimise_messages, should_continue
+from agent_nodes import AgentState, RunBudget, default_budget, should_continue, should_optimise, summarizer_for
+from agent_nodes import acall_model, acall_tool, aoptimise_messages, call_model, call_tool, optimise_messages
+from reduction import ContentReducer
+from tools.instrumentation import span
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
 
-def workflow(llm, model: str, tool_executor: ToolExecutor) -> CompiledGraph:
+def timed_node(stage: str, func: Callable, afunc: Callable) -> RunnableLambda:
+  """
+  Registers the sync and async implementations of a node, timing each run as node:<stage>.
+  """
+  def run(state):
+    with span(f"node:{stage}"):
+      return func(state)
+
+  async def arun(state):
+    with span(f"node:{stage}"):
+      return await afunc(state)
+
+  return RunnableLambda(run, afunc=arun)
+
+def workflow(llm, model: str, tool_executor: ToolExecutor, checkpointer=None, reducer: Optional[ContentReducer] = None, budget: Optional[RunBudget] = None, summarizer=None, summary_model: str = "") -> CompiledGraph:
+
+  reducer = reducer if reducer is not None else ContentReducer(model)
+  budget = budget if budget is not None else default_budget()
+  summarizer = summarizer if summarizer is not None else llm
 
   workflow = StateGraph(AgentState)
-  workflow.add_node("agent", partial(call_model, llm=llm))
-  workflow.add_node("action", partial(call_tool, tool_executor=tool_executor))
-  workflow.add_node("optimise", partial(optimise_messages, llm=llm, model=model))
+  ### Every node has a sync and an async implementation, so the graph runs with invoke and ainvoke alike
+  workflow.add_node("agent", timed_node("agent", partial(call_model, llm=llm, model=model), partial(acall_model, llm=llm, model=model)))
+  workflow.add_node("action", timed_node("action", partial(call_tool, tool_executor=tool_executor, reducer=reducer), partial(acall_tool, tool_executor=tool_executor, reducer=reducer)))
+  workflow.add_node("optimise", timed_node("optimise", partial(optimise_messages, llm=summarizer, model=model, summary_model=summary_model), partial(aoptimise_messages, llm=summarizer, model=model, summary_model=summary_model)))
   workflow.set_entry_point("agent")
-  workflow.add_conditional_edges("agent", should_continue,
+  workflow.add_conditional_edges("agent", partial(should_continue, budget=budget),
       {
           "continue": "action",
           "end": END
       }
   )
-  workflow.add_edge('action', 'optimise')
+  workflow.add_conditional_edges("action", partial(should_optimise, budget=budget),
+      {
+          "continue": "optimise",
+          "end": END
+      }
+  )
   workflow.add_edge('optimise', 'agent')
 
-  return workflow.compile()
\ No newline at end of file
+  return workflow.compile(checkpointer=checkpointer)
+
+_compiled: Dict[tuple, tuple] = {}
+_compiled_lock = threading.Lock()
+
+def compiled_workflow(name: str, llm, model: str, build_tools: Callable[[], Tuple[List, List]], checkpointer=None, budget: Optional[RunBudget] = None) -> CompiledGraph:
+  """
+  Returns the graph compiled for name, building its tools, their schemas and the tool binding of llm once per process.
+  Summaries go to the unbound summarizer model, without the tool schemas.
+
+  Args:
+      name (str): The name of the workflow, such as "internet_search".
+      llm: The chat model, bound to the tool schemas here.
+      model (str): The model name.
+      build_tools (Callable): Returns the tools to execute and the tool definitions to bind to llm.
+      checkpointer: The optional LangGraph checkpointer.
+      budget (RunBudget): The optional per-entity budget.
+  """
+  key = (name, id(llm), model, id(checkpointer), json.dumps(budget, sort_keys=True) if budget is not None else None)
+  with _compiled_lock:
+    if key not in _compiled:
+      tools, definitions = build_tools()
+      bound = llm.bind(tools=[convert_to_openai_tool(tool) for tool in definitions])
+      summarizer, summary_model = summarizer_for(llm, model)
+      ### Keeping llm and checkpointer referenced so their ids in the key stay unique
+      _compiled[key] = (workflow(llm=bound, model=model, tool_executor=ToolExecutor(tools), checkpointer=checkpointer, budget=budget,
+                                 summarizer=summarizer, summary_model=summary_model), llm, checkpointer)
+    return _compiled[key][0]
@@ -1,21 +1,28 @@
-from typing import Any, List
-from graph import workflow
+import asyncio
+from typing import Any, List, Optional
+from graph import compiled_workflow
+from agent_nodes import ReplaceMessages, RunBudget
 from tools.jinaai import ScrapeTool
 from tools.tavily import SearchTool
 from tools.custom import UpdateDataTool, update_data_definition
-from langgraph.prebuilt.tool_executor import ToolExecutor
+from extractors import extract_from_website, prefill_data_points
+from tools.instrumentation import count, span
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.utils.function_calling import convert_to_openai_tool
 
-def internet_search(llm, model: str, entity_name: str, data_points_to_search: List[str]) -> (dict[str, Any] | Any):
-  scrape = ScrapeTool()
-  update_data = UpdateDataTool(data_points_to_search)
+def search_tools():
+  """
+  Returns the tools executed by the internet search graph and the definitions bound to the model.
+  The tools keep no per-entity state, so one set serves every entity of the process.
+  """
+  update_data = UpdateDataTool()
   search = SearchTool()
-  llm = llm.bind(tools=[convert_to_openai_tool(tool) for tool in [update_data_definition, search, scrape ]])
-  tool_executor = ToolExecutor([update_data, search, scrape ])
-
-  app = workflow(llm=llm, model=model, tool_executor=tool_executor)
+  scrape = ScrapeTool()
+  return [update_data, search, scrape], [update_data_definition, search, scrape]
 
+def search_inputs(entity_name: str, data_points_to_search: List[str], data_points: List[dict], already_found: List[dict]) -> dict:
+  """
+  Returns the initial graph state of an entity's internet search.
+  """
   system_message = SystemMessage(content="""
     You are a world-class web researcher and scraper. Your goal is to find comprehensive and up-to-date 
     information on a given entity by leveraging the following tools:
@@ -45,7 +52,7 @@ def internet_search(llm, model: str, entity_name: str, data_points_to_search: Li
 	    4.Efficiency:
 	      * You will not scrape a URL more than once, even if the information is not found.
 	      * Do not ask the user for inputs or permissions; proceed autonomously to gather the required information.
-	      * Do not make more than two tool calls in a single turn.
+	      * Do not make more than four tool calls in a single turn.
 	      * Stop the search if all required data points are found or if no data points are found in the search list.
 	    5.Accuracy:
 	      * Ensure that all information is accurate and up-to-date.
@@ -64,15 +71,86 @@ def internet_search(llm, model: str, entity_name: str, data_points_to_search: Li
     For example, if data_points_to_search = [“company_name”, “company_phone”, “company_email”];
     The update_data expects the update_to_data dicts from the data_points_to_search list.
   """)
+  if already_found:
+    internet_search.content += f"""
+    Data points already found, do not search for these again: {already_found}
+    """
+
+  ### A thread starting over replaces the messages a previous run left in its checkpoint
+  inputs = {"messages": ReplaceMessages([system_message, internet_search]), 
+            "entity_name": entity_name,
+            "data_points": data_points,
+            "links_already_scraped": [],
+            "summary": "", "turns": 0, "tokens": 0, "cost": 0.0, "elapsed": 0.0}
+  return inputs
 
-  inputs = {"messages": [system_message, internet_search], 
-            "data_points": [{"name": dp, "value": None, "reference": None} for dp in data_points_to_search],
-            "links_already_scraped": []}
+def search_config(checkpointer=None, thread_id: Optional[str] = None) -> dict:
   config = {"recursion_limit": 100}
+  if checkpointer is not None and thread_id:
+    config["configurable"] = {"thread_id": thread_id}
+  return config
+
+def internet_search(llm, model: str, entity_name: str, data_points_to_search: List[str], checkpointer=None, thread_id: Optional[str] = None, resume: bool = False, website: Optional[str] = None, budget: Optional[RunBudget] = None) -> (dict[str, Any] | Any):
+  data_points = [{"name": dp, "value": None, "reference": None} for dp in data_points_to_search]
+
+  ### Fast path: reading what the known website states plainly before paying for the agent
+  already_found = []
+  if website:
+    with span("website"):
+      data_points, already_found = prefill_data_points(data_points, extract_from_website(website, data_points_to_search))
+    if all(dp["value"] is not None for dp in data_points):
+      return {"data_points": data_points}
+
+  app = compiled_workflow("internet_search", llm, model, search_tools, checkpointer=checkpointer, budget=budget)
+  inputs = search_inputs(entity_name, data_points_to_search, data_points, already_found)
+  config = search_config(checkpointer, thread_id)
+  if "configurable" in config:
+    snapshot = app.get_state(config)
+    ### Continuing an interrupted run from its last node with the state it had reached
+    if resume and snapshot.next:
+      print(f"resuming {entity_name} from {snapshot.next}")
+      data_points = snapshot.values.get("data_points") or data_points
+      inputs = None
   
+  ### Following the state as it streams, so the data points found so far survive a failing run
+  try:
+    for values in app.stream(inputs, config=config, stream_mode="values"):
+      data_points = values.get("data_points") or data_points
+  except Exception as e:
+    print(f"error while invoking work flow: {e}")
+    count("errors:workflow")
+
+  return {"data_points": data_points}
+
+async def internet_search_async(llm, model: str, entity_name: str, data_points_to_search: List[str], checkpointer=None, thread_id: Optional[str] = None, resume: bool = False, website: Optional[str] = None, budget: Optional[RunBudget] = None) -> (dict[str, Any] | Any):
+  """
+  Async variant of internet_search, running the graph with astream so many entities can share one event loop.
+  """
+  data_points = [{"name": dp, "value": None, "reference": None} for dp in data_points_to_search]
+
+  already_found = []
+  if website:
+    with span("website"):
+      extracted = await asyncio.to_thread(extract_from_website, website, data_points_to_search)
+    data_points, already_found = prefill_data_points(data_points, extracted)
+    if all(dp["value"] is not None for dp in data_points):
+      return {"data_points": data_points}
+
+  app = compiled_workflow("internet_search", llm, model, search_tools, checkpointer=checkpointer, budget=budget)
+  inputs = search_inputs(entity_name, data_points_to_search, data_points, already_found)
+  config = search_config(checkpointer, thread_id)
+  if "configurable" in config:
+    snapshot = await app.aget_state(config)
+    if resume and snapshot.next:
+      print(f"resuming {entity_name} from {snapshot.next}")
+      data_points = snapshot.values.get("data_points") or data_points
+      inputs = None
+
   try:
-    app.invoke(inputs,config=config)
+    async for values in app.astream(inputs, config=config, stream_mode="values"):
+      data_points = values.get("data_points") or data_points
   except Exception as e:
     print(f"error while invoking work flow: {e}")
+    count("errors:workflow")
 
-  return {"data_points": update_data.get_data_points()}
+  return {"data_points": data_points}
@@ -0,0 +1,269 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from termcolor import colored
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, TypedDict
+
+class Lease(TypedDict):
+  id: int
+  key: str
+  payload: dict
+  token: str
+  attempts: int
+
+class JobQueue(ABC):
+  """
+  Queue of entity jobs shared by a coordinator and any number of workers.
+
+  A leased job stays invisible to other workers for visibility_timeout seconds; a worker that dies
+  lets its lease expire and the job is leased again, up to max_attempts times. Backends implement
+  the abstract methods below; SqliteJobQueue serves local runs and workers sharing a file system.
+  """
+
+  @abstractmethod
+  def enqueue(self, jobs: Iterable[Tuple[str, dict]]) -> int:
+    """
+    Adds (key, payload) jobs, ignoring keys already queued, and returns how many were added.
+    """
+
+  @abstractmethod
+  def lease(self, worker: str, visibility_timeout: float) -> Optional[Lease]:
+    ...
+
+  @abstractmethod
+  def extend(self, lease: Lease, visibility_timeout: float) -> bool:
+    ...
+
+  @abstractmethod
+  def complete(self, lease: Lease, result: dict) -> bool:
+    ...
+
+  @abstractmethod
+  def fail(self, lease: Lease, error: str) -> bool:
+    ...
+
+  @abstractmethod
+  def finished(self, after: int = 0) -> List[dict]:
+    """
+    Returns the done and failed jobs that finished after the one numbered after, in finishing order,
+    each with its finishing number under "seq".
+    """
+
+  @abstractmethod
+  def counts(self) -> Dict[str, int]:
+    ...
+
+  @abstractmethod
+  def cursor(self, name: str) -> int:
+    """
+    Returns the finishing number up to which the reader name has consumed the finished jobs, 0 at first.
+    """
+
+  @abstractmethod
+  def set_cursor(self, name: str, seq: int):
+    ...
+
+  def close(self):
+    pass
+
+### Jobs are numbered in the order they finish, so the coordinator can follow results past a cursor
+NEXT_FINISHED_SEQ = "(SELECT COALESCE(MAX(finished_seq), 0) + 1 FROM queue_jobs)"
+
+class SqliteJobQueue(JobQueue):
+  """SQLite backed job queue, safe across threads and processes sharing the database file."""
+
+  def __init__(self, path: str = "./queue.sqlite", max_attempts: int = 3):
+    self.path = path
+    self.max_attempts = max_attempts
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    with self.lock:
+      self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS queue_jobs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          key TEXT NOT NULL UNIQUE,
+          payload TEXT NOT NULL,
+          status TEXT NOT NULL,
+          attempts INTEGER NOT NULL DEFAULT 0,
+          worker TEXT,
+          lease_token TEXT,
+          lease_expires REAL,
+          result TEXT,
+          error TEXT,
+          finished_seq INTEGER,
+          updated_at REAL NOT NULL
+        )""")
+      self.conn.execute("CREATE INDEX IF NOT EXISTS queue_jobs_status ON queue_jobs (status, id)")
+      self.conn.execute("CREATE INDEX IF NOT EXISTS queue_jobs_finished ON queue_jobs (finished_seq)")
+      self.conn.execute("CREATE TABLE IF NOT EXISTS queue_cursors (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)")
+
+  def _transaction(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+    ### BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same job
+    with self.lock:
+      self.conn.execute("BEGIN IMMEDIATE")
+      try:
+        result = work(self.conn)
+      except Exception:
+        self.conn.execute("ROLLBACK")
+        raise
+      self.conn.execute("COMMIT")
+      return result
+
+  def enqueue(self, jobs: Iterable[Tuple[str, dict]]) -> int:
+    now = time.time()
+    rows = [(key, json.dumps(payload, default=str), "pending", now) for key, payload in jobs]
+    def work(conn):
+      before = conn.total_changes
+      conn.executemany("INSERT OR IGNORE INTO queue_jobs (key, payload, status, updated_at) VALUES (?, ?, ?, ?)", rows)
+      return conn.total_changes - before
+    return self._transaction(work)
+
+  def lease(self, worker: str, visibility_timeout: float) -> Optional[Lease]:
+    def work(conn):
+      now = time.time()
+      ### Jobs whose last lease expired after their final attempt are given up on
+      expired = conn.execute("SELECT id FROM queue_jobs WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts)).fetchall()
+      for (job_id,) in expired:
+        conn.execute(f"UPDATE queue_jobs SET status = 'failed', error = 'lease expired after the last attempt', finished_seq = {NEXT_FINISHED_SEQ}, updated_at = ? WHERE id = ?",
+                     (now, job_id))
+      row = conn.execute("SELECT id, key, payload, attempts FROM queue_jobs WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                         "ORDER BY id LIMIT 1", (now,)).fetchone()
+      if row is None:
+        return None
+      token = uuid.uuid4().hex
+      conn.execute("UPDATE queue_jobs SET status = 'leased', attempts = attempts + 1, worker = ?, lease_token = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                   (worker, token, now + visibility_timeout, now, row[0]))
+      return Lease(id=row[0], key=row[1], payload=json.loads(row[2]), token=token, attempts=row[3] + 1)
+    return self._transaction(work)
+
+  def _update_leased(self, lease: Lease, assignments: str, values: tuple) -> bool:
+    ### Only the current holder of the lease may update the job; a lost lease is silently outdated
+    def work(conn):
+      cursor = conn.execute(f"UPDATE queue_jobs SET {assignments}, updated_at = ? WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                            values + (time.time(), lease["id"], lease["token"]))
+      return cursor.rowcount == 1
+    return self._transaction(work)
+
+  def extend(self, lease: Lease, visibility_timeout: float) -> bool:
+    return self._update_leased(lease, "lease_expires = ?", (time.time() + visibility_timeout,))
+
+  def complete(self, lease: Lease, result: dict) -> bool:
+    return self._update_leased(lease, f"status = 'done', result = ?, error = NULL, lease_token = NULL, finished_seq = {NEXT_FINISHED_SEQ}",
+                               (json.dumps(result, default=str),))
+
+  def fail(self, lease: Lease, error: str) -> bool:
+    if lease["attempts"] >= self.max_attempts:
+      return self._update_leased(lease, f"status = 'failed', error = ?, lease_token = NULL, finished_seq = {NEXT_FINISHED_SEQ}", (error,))
+    return self._update_leased(lease, "status = 'pending', error = ?, lease_token = NULL", (error,))
+
+  def finished(self, after: int = 0) -> List[dict]:
+    with self.lock:
+      rows = self.conn.execute("SELECT finished_seq, key, payload, status, result, error FROM queue_jobs WHERE finished_seq > ? ORDER BY finished_seq",
+                               (after,)).fetchall()
+    return [{"seq": row[0], "key": row[1], "payload": json.loads(row[2]), "status": row[3],
+             "result": None if row[4] is None else json.loads(row[4]), "error": row[5]} for row in rows]
+
+  def counts(self) -> Dict[str, int]:
+    with self.lock:
+      rows = self.conn.execute("SELECT status, COUNT(*) FROM queue_jobs GROUP BY status").fetchall()
+    return {"pending": 0, "leased": 0, "done": 0, "failed": 0, **dict(rows)}
+
+  def cursor(self, name: str) -> int:
+    with self.lock:
+      row = self.conn.execute("SELECT seq FROM queue_cursors WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+  def set_cursor(self, name: str, seq: int):
+    self._transaction(lambda conn: conn.execute("INSERT INTO queue_cursors (name, seq) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET seq = excluded.seq",
+                                                (name, seq)))
+
+  def close(self):
+    with self.lock:
+      self.conn.close()
+
+def open_queue(url: str, max_attempts: int = 3) -> JobQueue:
+  """
+  Opens the job queue at url; sqlite:///path and plain paths open a SqliteJobQueue.
+  """
+  if url.startswith("sqlite:///"):
+    url = url[len("sqlite:///"):]
+  elif "://" in url:
+    raise ValueError(f"unsupported job queue backend: {url}")
+  return SqliteJobQueue(url, max_attempts=max_attempts)
+
+def drained(queue: JobQueue) -> bool:
+  counts = queue.counts()
+  return counts["pending"] == 0 and counts["leased"] == 0
+
+def work_lease(queue: JobQueue, lease: Lease, process: Callable[[dict], dict], visibility_timeout: float):
+  """
+  Processes one leased job, extending its lease while it runs and posting the result or the error back.
+  """
+  stop = threading.Event()
+  def heartbeat():
+    while not stop.wait(visibility_timeout / 3):
+      if not queue.extend(lease, visibility_timeout):
+        print(colored(f"""lease of {lease["payload"].get("Entity")} was lost""", "red"))
+        return
+
+  beat = threading.Thread(target=heartbeat, daemon=True)
+  beat.start()
+  try:
+    result = process(lease["payload"])
+  except Exception as e:
+    print(colored(f"""error while processing {lease["payload"].get("Entity")}: {e}""", "red"))
+    queue.fail(lease, str(e))
+    return
+  finally:
+    stop.set()
+  queue.complete(lease, result)
+
+def run_worker(queue: JobQueue, process: Callable[[dict], dict], workers: int = 4, visibility_timeout: float = 600, poll: float = 2.0, follow: bool = False):
+  """
+  Leases and processes jobs on workers threads until the queue is drained, or forever with follow.
+
+  Args:
+      queue (JobQueue): The shared job queue.
+      process (Callable): Returns the result of a job payload.
+      workers (int): The jobs processed concurrently by this worker.
+      visibility_timeout (float): The seconds a lease lasts without a heartbeat.
+      poll (float): The seconds between attempts while no job is available.
+      follow (bool): Keep waiting for new jobs once the queue is drained.
+  """
+  name = f"{uuid.uuid4().hex[:8]}"
+
+  def loop(i: int):
+    while True:
+      lease = queue.lease(f"{name}-{i}", visibility_timeout)
+      if lease is None:
+        if not follow and drained(queue):
+          return
+        time.sleep(poll)
+        continue
+      work_lease(queue, lease, process, visibility_timeout)
+
+  threads = [threading.Thread(target=loop, args=(i,), name=f"worker-{i}") for i in range(max(1, workers))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+def follow_results(queue: JobQueue, after: int = 0, poll: float = 2.0) -> Iterable[dict]:
+  """
+  Yields the jobs finished after the one numbered after as workers post them, until the queue is drained.
+  """
+  while True:
+    finished = queue.finished(after)
+    for job in finished:
+      after = job["seq"]
+      yield job
+    if not finished:
+      if drained(queue):
+        for job in queue.finished(after):
+          yield job
+        return
+      time.sleep(poll)
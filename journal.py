@@ -0,0 +1,84 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+class Journal:
+  """Durable SQLite record of the entities processed in a batch run and what they returned."""
+
+  def __init__(self, path: str = "./journal.sqlite"):
+    self.path = path
+    self.lock = threading.Lock()
+    self.conn = self._connect()
+    with self.lock, self.conn:
+      self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+          key TEXT PRIMARY KEY,
+          entity TEXT NOT NULL,
+          data_points TEXT NOT NULL,
+          status TEXT NOT NULL,
+          result TEXT,
+          error TEXT,
+          updated_at REAL NOT NULL
+        )""")
+
+  def _connect(self) -> sqlite3.Connection:
+    conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+  @staticmethod
+  def job_key(entity: str, data_points: List[str]) -> str:
+    """
+    Returns a stable key for an entity and the list of data points searched for it.
+    """
+    return hashlib.sha256(json.dumps([entity, data_points]).encode("utf-8")).hexdigest()
+
+  def _set(self, key: str, entity: str, data_points: List[str], status: str, result: Optional[dict] = None, error: Optional[str] = None):
+    with self.lock, self.conn:
+      self.conn.execute(
+        "INSERT OR REPLACE INTO jobs (key, entity, data_points, status, result, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (key, entity, json.dumps(data_points), status, None if result is None else json.dumps(result), error, time.time()))
+
+  def mark_started(self, key: str, entity: str, data_points: List[str]):
+    self._set(key, entity, data_points, "running")
+
+  def mark_done(self, key: str, entity: str, data_points: List[str], result: dict):
+    self._set(key, entity, data_points, "done", result=result)
+
+  def mark_failed(self, key: str, entity: str, data_points: List[str], error: str):
+    self._set(key, entity, data_points, "failed", error=error)
+
+  def get(self, key: str) -> Optional[dict]:
+    with self.lock:
+      row = self.conn.execute("SELECT entity, data_points, status, result, error FROM jobs WHERE key = ?", (key,)).fetchone()
+    if row is None:
+      return None
+    return {"entity": row[0], "data_points": json.loads(row[1]), "status": row[2],
+            "result": None if row[3] is None else json.loads(row[3]), "error": row[4]}
+
+  def is_done(self, key: str) -> bool:
+    job = self.get(key)
+    return job is not None and job["status"] == "done"
+
+  def checkpointer(self):
+    """
+    Returns a LangGraph checkpointer stored in the same database, so an entity interrupted
+    partway through continues from its last node.
+    """
+    return SqliteSaver(self._connect())
+
+  def async_checkpointer(self):
+    """
+    Returns the checkpointer of async runs, stored in the same database: SqliteSaver has no async methods.
+    Open it with async with on the event loop running the graphs.
+    """
+    from langgraph.checkpoint.aiosqlite import AsyncSqliteSaver
+    return AsyncSqliteSaver.from_conn_string(self.path)
+
+  def close(self):
+    with self.lock:
+      self.conn.close()
@@ -0,0 +1,192 @@
+import time
+import queue
+import threading
+from termcolor import colored
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from agent_nodes import RunBudget
+from batch_extract import batch_extract
+from extractors import extract_from_website, prefill_data_points
+from internetsearch import internet_search
+from websitescrap import website_scrap
+from tools import instrumentation
+from tools.jinaai import ScrapeTool
+from tools.instrumentation import span
+
+STOP = object()
+
+def missing_data_points(data_points: List[dict]) -> List[str]:
+  return [dp["name"] for dp in data_points if dp["value"] is None]
+
+def merge_found(data_points: List[dict], found: List[dict]) -> List[dict]:
+  """
+  Fills the data points still missing with the ones a later stage found.
+  """
+  data_points, _ = prefill_data_points(data_points, [dp for dp in found if dp.get("value") is not None])
+  return data_points
+
+class Pipeline:
+  """
+  Runs entities through three stages, each on its own worker threads fed by its own bounded queue:
+
+    fetch: reads the known website without the model, extracting plainly stated data points and
+           warming the scrape cache with its homepage.
+    extract: with batch_size, extracts from the homepages of up to batch_size entities per model request.
+    website: runs the website_scrap graph on that website for the data points still missing.
+    search: runs the internet_search graph for the entities that still have gaps.
+
+  Entities leave the pipeline as soon as their data points are complete, so results come out in
+  completion order rather than input order.
+
+  Args:
+      llm: The chat model.
+      model (str): The model name.
+      data_points (List[str]): The data points to find for every entity.
+      fetch_workers (int): The threads fetching websites.
+      website_workers (int): The threads running website_scrap.
+      search_workers (int): The threads running internet_search.
+      budget (RunBudget): The optional per-entity budget of internet_search.
+      queue_size (int): The entities waiting at most before each stage.
+      batch_size (int): The entities collected for one batched extraction, 0 to skip the extract stage.
+      batch_wait (float): The seconds the extract stage waits for a batch to fill up.
+  """
+
+  def __init__(self, llm, model: str, data_points: List[str], fetch_workers: int = 16, website_workers: int = 4, search_workers: int = 4,
+               budget: Optional[RunBudget] = None, queue_size: int = 100, batch_size: int = 0, batch_wait: float = 2.0):
+    self.llm = llm
+    self.model = model
+    self.data_points = data_points
+    self.budget = budget
+    self.batch_size = batch_size
+    self.batch_wait = batch_wait
+    self.workers = {"fetch": max(1, fetch_workers), "extract": 1 if batch_size > 0 else 0, "website": max(1, website_workers), "search": max(1, search_workers)}
+    self.queues: Dict[str, queue.Queue] = {stage: queue.Queue(maxsize=queue_size) for stage in self.workers}
+    self.done: queue.Queue = queue.Queue()
+    self.stages: Dict[str, Callable[[dict], Optional[str]]] = {"fetch": self.fetch, "website": self.website, "search": self.search}
+
+  def fetch(self, job: dict) -> Optional[str]:
+    website = job["website"]
+    if not website:
+      return "search"
+    with span("pipeline:fetch"):
+      job["data_points"] = merge_found(job["data_points"], extract_from_website(website, missing_data_points(job["data_points"])))
+      if missing_data_points(job["data_points"]):
+        page = ScrapeTool().invoke({"url": website})
+        if page.result:
+          job["pages"] = [{"url": website, "content": page.result}]
+    if not missing_data_points(job["data_points"]):
+      return None
+    return "extract" if self.batch_size > 0 and job["pages"] else "website"
+
+  def extract(self, jobs: List[dict]):
+    """
+    Extracts the missing data points of jobs from their homepages, several entities per model request.
+    """
+    items = [{"id": str(i), "entity": job["row"]["Entity"], "data_points": job["data_points"], "pages": job["pages"]} for i, job in enumerate(jobs)]
+    updated = batch_extract(self.llm, self.model, items)
+    for i, job in enumerate(jobs):
+      job["data_points"] = updated.get(str(i), job["data_points"])
+
+  def website(self, job: dict) -> Optional[str]:
+    with span("pipeline:website"):
+      output = website_scrap(self.llm, self.model, [job["website"]], job["row"]["Entity"], missing_data_points(job["data_points"]), job["links"])
+    job["data_points"] = merge_found(job["data_points"], output["data_points"])
+    job["links"] = output["links_already_scraped"]
+    return "search" if missing_data_points(job["data_points"]) else None
+
+  def search(self, job: dict) -> Optional[str]:
+    with span("pipeline:search"):
+      output = internet_search(self.llm, self.model, job["row"]["Entity"], missing_data_points(job["data_points"]), budget=self.budget)
+    job["data_points"] = merge_found(job["data_points"], output["data_points"])
+    return None
+
+  def _batch_worker(self):
+    inbox = self.queues["extract"]
+    stopping = False
+    while not stopping:
+      jobs = []
+      job = inbox.get()
+      deadline = time.monotonic() + self.batch_wait
+      while job is not STOP and len(jobs) < self.batch_size:
+        jobs.append(job)
+        if len(jobs) == self.batch_size:
+          break
+        try:
+          job = inbox.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+          break
+      stopping = job is STOP
+      if not jobs:
+        continue
+      try:
+        self.extract(jobs)
+      except Exception as e:
+        print(colored(f"error in extract stage for {len(jobs)} entities: {e}", "red"))
+      for job in jobs:
+        if missing_data_points(job["data_points"]):
+          self.queues["website"].put(job)
+        else:
+          self.done.put(job)
+
+  def _worker(self, stage: str):
+    inbox = self.queues[stage]
+    while True:
+      job = inbox.get()
+      if job is STOP:
+        return
+      try:
+        with instrumentation.bind(job["metrics"]):
+          next_stage = self.stages[stage](job)
+      except Exception as e:
+        print(colored(f"""error in {stage} stage for {job["row"]["Entity"]}: {e}""", "red"))
+        ### The search stage can still find what the website stages failed to read
+        if stage == "search":
+          job["error"] = e
+        next_stage = None if stage == "search" else "search"
+      if next_stage is None:
+        self.done.put(job)
+      else:
+        self.queues[next_stage].put(job)
+
+  def _feed(self, rows: Iterable[dict], submitted: List[int], finished: threading.Event):
+    try:
+      for row in rows:
+        website = row.get("Website")
+        job = {"row": row, "website": website.strip() if isinstance(website, str) and website.strip() else None,
+               "data_points": [{"name": dp, "value": None, "reference": None} for dp in self.data_points],
+               "pages": [], "links": [], "error": None, "metrics": instrumentation.start_entity(row["Entity"])}
+        submitted[0] += 1
+        self.queues["fetch"].put(job)
+    except Exception as e:
+      print(colored(f"error while reading entities: {e}", "red"))
+    finally:
+      finished.set()
+      self.done.put(STOP)
+
+  def run(self, rows: Iterable[dict]) -> Iterator[Tuple[dict, Any, Optional[Exception]]]:
+    """
+    Runs rows through the pipeline.
+
+    Returns:
+        Iterator: (row, output, error) tuples in completion order, output holding the data points.
+    """
+    threads = [threading.Thread(target=self._batch_worker if stage == "extract" else self._worker, args=() if stage == "extract" else (stage,), name=f"{stage}-{i}", daemon=True)
+               for stage, workers in self.workers.items() for i in range(workers)]
+    for thread in threads:
+      thread.start()
+
+    submitted, received = [0], 0
+    finished = threading.Event()
+    feeder = threading.Thread(target=self._feed, args=(rows, submitted, finished), name="pipeline-feed", daemon=True)
+    feeder.start()
+    try:
+      while not (finished.is_set() and received == submitted[0]):
+        job = self.done.get()
+        if job is STOP:
+          continue
+        received += 1
+        instrumentation.finish_entity(job["metrics"], str(job["error"]) if job["error"] is not None else None)
+        yield job["row"], {"data_points": job["data_points"]}, job["error"]
+    finally:
+      for stage, workers in self.workers.items():
+        for _ in range(workers):
+          self.queues[stage].put(STOP)
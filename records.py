@@ -0,0 +1,85 @@
+import os
+import csv
+import json
+import pandas as pd
+from abc import ABC, abstractmethod
+from typing import Any, Iterator, List, Optional
+
+def read_entities(filename: str, chunksize: int = 1000) -> Iterator[dict]:
+  """
+  Streams the rows of the input CSV file in chunks so large files never sit fully in memory.
+  """
+  for chunk in pd.read_csv(filename, header=0, chunksize=chunksize):
+    for row in chunk.to_dict("records"):
+      yield row
+
+class RecordWriter(ABC):
+  """Appends one record per entity to the output file as soon as the entity completes."""
+
+  def __init__(self, path: str, data_points: List[str], append: bool = False, flush_every: int = 1):
+    self.path = path
+    self.data_points = data_points
+    self.flush_every = max(1, flush_every)
+    self.pending = 0
+    self.is_new = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+    self.file = open(path, "a" if append else "w", newline="", encoding="utf-8")
+
+  def write(self, entity: str, data_points: Optional[List[dict]], error: Optional[Any] = None):
+    self._write(entity, data_points or [], error)
+    self.pending += 1
+    if self.pending >= self.flush_every:
+      self.flush()
+
+  @abstractmethod
+  def _write(self, entity: str, data_points: List[dict], error: Optional[Any]):
+    ...
+
+  def flush(self):
+    self.file.flush()
+    self.pending = 0
+
+  def close(self):
+    if not self.file.closed:
+      self.flush()
+      self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+class CsvRecordWriter(RecordWriter):
+  """Writes one CSV row per entity with a value and a reference column per data point."""
+
+  def __init__(self, path: str, data_points: List[str], append: bool = False, flush_every: int = 1):
+    super().__init__(path, data_points, append=append, flush_every=flush_every)
+    columns = ["Entity"]
+    for dp in data_points:
+      columns += [dp, f"{dp} Reference"]
+    columns.append("Error")
+    self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction="ignore")
+    if self.is_new:
+      self.writer.writeheader()
+
+  def _write(self, entity: str, data_points: List[dict], error: Optional[Any]):
+    row = {"Entity": entity, "Error": "" if error is None else str(error)}
+    for dp in data_points:
+      row[dp["name"]] = dp["value"]
+      row[f"""{dp["name"]} Reference"""] = dp.get("reference")
+    self.writer.writerow(row)
+
+class JsonlRecordWriter(RecordWriter):
+  """Writes one JSON object per line per entity, keeping the data points with their references."""
+
+  def _write(self, entity: str, data_points: List[dict], error: Optional[Any]):
+    record = {"entity": entity, "data_points": data_points, "error": None if error is None else str(error)}
+    self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def open_writer(path: str, data_points: List[str], append: bool = False, flush_every: int = 1) -> RecordWriter:
+  """
+  Opens a record writer for path, choosing JSONL for .jsonl/.ndjson files and CSV otherwise.
+  """
+  if path.endswith((".jsonl", ".ndjson")):
+    return JsonlRecordWriter(path, data_points, append=append, flush_every=flush_every)
+  return CsvRecordWriter(path, data_points, append=append, flush_every=flush_every)
@@ -0,0 +1,148 @@
+import os
+import re
+from typing import Callable, Iterable, List, Optional, Sequence, TypedDict
+from tokens import get_encoding
+
+TOOL_RESULT_TOKEN_BUDGET = int(os.getenv("TOOL_RESULT_TOKEN_BUDGET", 3000))
+
+class ReductionContext(TypedDict):
+  tool: str
+  entity_name: str
+  missing_data_points: List[str]
+  model: str
+  max_tokens: int
+
+Reducer = Callable[[str, ReductionContext], str]
+
+### Words hinting that a block of a page holds a given data point
+DATA_POINT_KEYWORDS = {
+  "name": ["name", "company", "ltd", "inc", "llc", "private limited", "pvt"],
+  "website": ["website", "www.", "http"],
+  "description": ["about", "who we are", "mission", "overview", "we are", "provides", "offers"],
+  "address": ["address", "office", "headquarter", "street", "road", "floor", "city", "zip", "location"],
+  "phone": ["phone", "tel:", "telephone", "call", "mobile", "contact", "+"],
+  "email": ["email", "e-mail", "mail", "@"],
+  "founder": ["founder", "founded", "co-founder", "started by"],
+  "ceo": ["ceo", "chief executive", "managing director", "president", "leadership"],
+}
+
+### Banners are short standalone lines; longer lines mentioning these words are page content
+BANNER_MAX_CHARS = 200
+BOILERPLATE_PATTERNS = [
+  re.compile(r"\bcookies?\b|accept all|reject all|privacy preferences|\bconsent\b", re.I),
+  re.compile(r"subscribe to (our )?newsletter|sign up for (our )?newsletter", re.I),
+  re.compile(r"^\s*(skip to (main )?content|back to top|toggle navigation|menu|search|log ?in|sign ?in|sign ?up)\s*$", re.I),
+]
+MARKDOWN_IMAGE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+CONTACT_HINT = re.compile(r"mailto:|tel:|@|\+?\d[\d\s().-]{6,}\d")
+
+def strip_boilerplate(content: str, context: ReductionContext) -> str:
+  """
+  Drops images, navigation link lists, cookie banners and newsletter prompts, keeping contact details
+  and lines mentioning the entity or the data points still missing.
+  """
+  keywords = keywords_for(context["missing_data_points"], context["entity_name"])
+  lines = []
+  for line in content.splitlines():
+    if CONTACT_HINT.search(line):
+      lines.append(line)
+      continue
+    line = MARKDOWN_IMAGE.sub("", line)
+    if len(line.strip()) <= BANNER_MAX_CHARS and any(pattern.search(line) for pattern in BOILERPLATE_PATTERNS) and not mentions(MARKDOWN_LINK.sub(r"\1", line), keywords):
+      continue
+    ### Lines made of links with little text around them are menus, footers and link farms
+    text = MARKDOWN_LINK.sub("", line).strip(" \t*-|•·>#")
+    if MARKDOWN_LINK.search(line) and len(text) < 20 and not mentions(text, keywords):
+      continue
+    lines.append(line)
+  return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def split_blocks(content: str) -> List[str]:
+  return [block.strip() for block in re.split(r"\n\s*\n", content) if block.strip()]
+
+def dedupe_blocks(content: str, context: ReductionContext) -> str:
+  """
+  Removes blocks repeated on the page, such as headers and footers rendered twice.
+  """
+  seen = set()
+  blocks = []
+  for block in split_blocks(content):
+    key = " ".join(block.lower().split())
+    if key in seen:
+      continue
+    seen.add(key)
+    blocks.append(block)
+  return "\n\n".join(blocks)
+
+def keywords_for(data_points: Iterable[str], entity_name: str) -> List[str]:
+  keywords = [word.lower() for word in re.findall(r"\w{3,}", entity_name or "")]
+  for dp in data_points:
+    name = dp.lower()
+    matched = [words for key, words in DATA_POINT_KEYWORDS.items() if key in name]
+    keywords += [word for words in matched for word in words] or [name]
+  return keywords
+
+def mentions(text: str, keywords: Iterable[str]) -> bool:
+  lowered = text.lower()
+  return any(keyword in lowered for keyword in keywords)
+
+def select_relevant(content: str, context: ReductionContext) -> str:
+  """
+  Keeps the blocks most relevant to the missing data points, in page order, within the token budget.
+  """
+  encoding = get_encoding(context["model"])
+  if len(encoding.encode(content)) <= context["max_tokens"]:
+    return content
+
+  blocks = split_blocks(content)
+  keywords = keywords_for(context["missing_data_points"], context["entity_name"])
+  scored = []
+  for index, block in enumerate(blocks):
+    lowered = block.lower()
+    score = sum(lowered.count(keyword) for keyword in keywords)
+    ### The page title and opening block usually name and describe the entity
+    if index == 0:
+      score += 1000
+    scored.append((score, index, block))
+
+  selected = []
+  budget = context["max_tokens"]
+  for score, index, block in sorted(scored, key=lambda item: (-item[0], item[1])):
+    if score == 0 and selected:
+      break
+    tokens = encoding.encode(block)
+    if len(tokens) > budget:
+      if not selected:
+        selected.append((index, encoding.decode(tokens[:budget])))
+      continue
+    selected.append((index, block))
+    budget -= len(tokens)
+  return "\n\n".join(block for _, block in sorted(selected))
+
+DEFAULT_REDUCERS: Sequence[Reducer] = (strip_boilerplate, dedupe_blocks, select_relevant)
+
+class ContentReducer:
+  """
+  Pre-LLM reduction pipeline applied to tool results before they enter the message history.
+
+  Args:
+      model (str): The model whose tokenizer measures the budget.
+      max_tokens (int): The token budget per tool result.
+      reducers (Sequence[Reducer]): The reduction steps, run in order.
+      tools (Sequence[str]): The names of the tools whose results are reduced.
+  """
+
+  def __init__(self, model: str, max_tokens: int = TOOL_RESULT_TOKEN_BUDGET, reducers: Optional[Sequence[Reducer]] = None, tools: Sequence[str] = ("scrape",)):
+    self.model = model
+    self.max_tokens = max_tokens
+    self.reducers = list(DEFAULT_REDUCERS if reducers is None else reducers)
+    self.tools = set(tools)
+
+  def __call__(self, content: str, tool: str, missing_data_points: List[str], entity_name: str = "") -> str:
+    if tool not in self.tools or not content:
+      return content
+    context = ReductionContext(tool=tool, entity_name=entity_name, missing_data_points=missing_data_points, model=self.model, max_tokens=self.max_tokens)
+    for reducer in self.reducers:
+      content = reducer(content, context)
+    return content
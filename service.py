@@ -0,0 +1,137 @@
+import io
+import json
+import threading
+from termcolor import colored
+from typing import Any, Callable, Iterator, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from batch import run_batch
+from records import read_entities
+
+class SearchService:
+  """
+  Long-running search service, keeping the model client, compiled graphs and token encoder of one
+  process warm across jobs.
+
+  Every request shares the same workers slots, so concurrent jobs queue behind each other instead of
+  multiplying the load on the providers.
+
+  Args:
+      process (Callable): Returns the output of an input row, as app.py's search does.
+      workers (int): The entities processed at the same time across all requests.
+      chunksize (int): The rows read at a time from files.
+  """
+
+  def __init__(self, process: Callable[[dict], dict], workers: int = 4, chunksize: int = 1000):
+    self.process = process
+    self.workers = max(1, workers)
+    self.chunksize = chunksize
+    self.slots = threading.BoundedSemaphore(self.workers)
+
+  def _process(self, row: dict) -> dict:
+    with self.slots:
+      return self.process(row)
+
+  def rows(self, request: dict) -> Iterator[dict]:
+    """
+    Returns the rows of a JSON request: one "entity" with an optional "website", a list of "entities"
+    rows, or the path of a server side input "file".
+    """
+    if request.get("entity"):
+      return iter([{"Entity": request["entity"], "Website": request.get("website")}])
+    if isinstance(request.get("entities"), list):
+      return iter([row if isinstance(row, dict) else {"Entity": row} for row in request["entities"]])
+    if request.get("file"):
+      return read_entities(request["file"], self.chunksize)
+    raise ValueError('expected "entity", "entities" or "file"')
+
+  def csv_rows(self, body: str) -> Iterator[dict]:
+    return read_entities(io.StringIO(body), self.chunksize)
+
+  def run(self, rows: Iterator[dict]) -> Iterator[dict]:
+    """
+    Processes rows and returns their records in input order, as the JSONL output writes them.
+    """
+    for row, output, error in run_batch(self._process, rows, workers=self.workers):
+      yield {"entity": row.get("Entity"), "data_points": output["data_points"] if output else [], "error": None if error is None else str(error)}
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+  """
+  POST /search with a JSON request or a text/csv body streams one JSON record per line back as entities finish;
+  GET /health answers once the service is warm.
+  """
+  service: SearchService
+
+  def _send_json(self, status: int, body: dict):
+    payload = json.dumps(body).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def do_GET(self):
+    if self.path != "/health":
+      self._send_json(404, {"error": f"unknown path {self.path}"})
+      return
+    self._send_json(200, {"status": "ok", "workers": self.service.workers})
+
+  def do_POST(self):
+    if self.path != "/search":
+      self._send_json(404, {"error": f"unknown path {self.path}"})
+      return
+    body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode("utf-8")
+    try:
+      if self.headers.get("Content-Type", "").startswith("text/csv"):
+        rows = self.service.csv_rows(body)
+      else:
+        rows = self.service.rows(json.loads(body or "{}"))
+    except Exception as e:
+      self._send_json(400, {"error": str(e)})
+      return
+
+    ### Without a Content-Length the response streams until the connection closes
+    self.send_response(200)
+    self.send_header("Content-Type", "application/x-ndjson")
+    self.end_headers()
+    try:
+      for record in self.service.run(rows):
+        self.wfile.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+      print(colored("client disconnected before its entities finished", "red"))
+    except Exception as e:
+      print(colored(f"error while processing request: {e}", "red"))
+      self.wfile.write((json.dumps({"error": str(e)}) + "\n").encode("utf-8"))
+
+def parse_address(address: str) -> Tuple[str, int]:
+  """
+  Parses host:port, or a bare port served on localhost.
+  """
+  host, _, port = address.rpartition(":")
+  return host or "127.0.0.1", int(port)
+
+def serve(address: str, process: Callable[[dict], dict], workers: int = 4, chunksize: int = 1000, warm: Optional[Callable[[], Any]] = None):
+  """
+  Serves process over HTTP at address until interrupted.
+
+  Args:
+      address (str): host:port to listen on.
+      process (Callable): Returns the output of an input row.
+      workers (int): The entities processed at the same time across all requests.
+      chunksize (int): The rows read at a time from files.
+      warm (Callable): Builds what the first request would otherwise wait for, before listening.
+  """
+  if warm is not None:
+    warm()
+  service = SearchService(process, workers=workers, chunksize=chunksize)
+  handler = type("Handler", (SearchRequestHandler,), {"service": service})
+  server = ThreadingHTTPServer(parse_address(address), handler)
+  server.daemon_threads = True
+  host, port = server.server_address[:2]
+  print(f"serving on http://{host}:{port}, POST /search")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
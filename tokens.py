@@ -0,0 +1,100 @@
+import json
+import hashlib
+import threading
+import tiktoken
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Sequence, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+### Chat format overhead per message and for priming the reply, as documented for the OpenAI chat models
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+MAX_CACHED_MESSAGES = 10000
+
+ROLES = {AIMessage: "assistant", HumanMessage: "user", SystemMessage: "system", ToolMessage: "tool"}
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+  """
+  Returns the tiktoken encoding of model, loaded once per process.
+  """
+  try:
+    return tiktoken.encoding_for_model(model)
+  except KeyError:
+    return tiktoken.get_encoding("o200k_base")
+
+_counts: "OrderedDict[tuple, int]" = OrderedDict()
+_counts_lock = threading.Lock()
+
+def message_key(message: BaseMessage) -> str:
+  """
+  Identifies a message by its id when it has one, otherwise by a hash of what is sent to the model.
+  """
+  if message.id:
+    return f"id:{message.id}"
+  payload = json.dumps([message.type, message.content, getattr(message, "name", None), message.additional_kwargs.get("tool_calls")], default=str)
+  return "sha:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _count(message: BaseMessage, encoding: tiktoken.Encoding) -> int:
+  count = TOKENS_PER_MESSAGE
+  count += len(encoding.encode(ROLES.get(type(message), message.type)))
+  content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+  count += len(encoding.encode(content))
+  if getattr(message, "name", None):
+    count += TOKENS_PER_NAME + len(encoding.encode(message.name))
+  tool_calls = message.additional_kwargs.get("tool_calls")
+  if tool_calls:
+    count += len(encoding.encode(json.dumps(tool_calls, default=str)))
+  return count
+
+def count_message_tokens(message: BaseMessage, model: str) -> int:
+  """
+  Returns the tokens message takes in a chat request, tokenizing each message only once.
+  """
+  key = (model, message_key(message))
+  with _counts_lock:
+    if key in _counts:
+      _counts.move_to_end(key)
+      return _counts[key]
+
+  count = _count(message, get_encoding(model))
+  with _counts_lock:
+    _counts[key] = count
+    if len(_counts) > MAX_CACHED_MESSAGES:
+      _counts.popitem(last=False)
+  return count
+
+def count_messages_tokens(messages: Sequence[BaseMessage], model: str) -> int:
+  """
+  Returns the tokens a chat request with messages takes, including the reply priming.
+  """
+  return sum(count_message_tokens(message, model) for message in messages if message is not None) + TOKENS_PER_REPLY
+
+### USD per million prompt and completion tokens
+MODEL_PRICES = {
+  "gpt-4o": (5.00, 15.00),
+  "gpt-4o-mini": (0.15, 0.60),
+  "gpt-4-turbo": (10.00, 30.00),
+  "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+  """
+  Returns the estimated USD cost of a call, matching dated model names such as gpt-4o-2024-05-13 to their family.
+  """
+  family = max((name for name in MODEL_PRICES if model.startswith(name)), key=len, default=None)
+  if family is None:
+    return 0.0
+  prompt_price, completion_price = MODEL_PRICES[family]
+  return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def response_usage(response: BaseMessage, messages: Sequence[BaseMessage], model: str) -> Tuple[int, int]:
+  """
+  Returns the (prompt, completion) tokens of a chat call, from the usage the API reported when available.
+  """
+  usage = getattr(response, "usage_metadata", None)
+  if usage:
+    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+  return count_messages_tokens(messages, model), count_message_tokens(response, model)
@@ -0,0 +1,155 @@
+import os
+import time
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_BLOB_PATH = "./.cache/blobs"
+### Tool results longer than BLOB_MIN_CHARS leave the graph state, which keeps their first BLOB_PREVIEW_CHARS
+BLOB_MIN_CHARS = int(os.getenv("BLOB_MIN_CHARS", 4000))
+BLOB_PREVIEW_CHARS = int(os.getenv("BLOB_PREVIEW_CHARS", 500))
+MAX_CACHED_BLOBS = 256
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_MB = 512
+### Seconds between sweeps of the store, which also runs once a tenth of max_bytes was written since the last one
+SWEEP_INTERVAL = 300
+
+class BlobStore:
+  """
+  Content-addressed store of large texts on disk, written once and shared across entities and runs.
+
+  Blobs are zlib compressed files named by the sha256 of their text, and the most recently read
+  ones are kept in memory since a message is materialized on every model turn. Like the DiskCache,
+  blobs expire after ttl seconds and the least recently used ones are removed once the store exceeds
+  max_bytes; a message whose blob is gone is sent with its preview.
+  """
+
+  def __init__(self, path: str = DEFAULT_BLOB_PATH, ttl: float = DEFAULT_TTL_SECONDS, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+    self.path = path
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self.recent: "OrderedDict[str, str]" = OrderedDict()
+    self.lock = threading.Lock()
+    self.written = 0
+    self.swept_at = 0.0
+    os.makedirs(path, exist_ok=True)
+
+  def _file(self, digest: str) -> str:
+    return os.path.join(self.path, digest[:2], digest[2:])
+
+  def put(self, content: str) -> str:
+    """
+    Stores content and returns its handle.
+    """
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    file = self._file(digest)
+    if os.path.exists(file):
+      self._touch(file)
+    else:
+      os.makedirs(os.path.dirname(file), exist_ok=True)
+      temporary = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+      compressed = zlib.compress(content.encode("utf-8"))
+      with open(temporary, "wb") as f:
+        f.write(compressed)
+      os.replace(temporary, file)
+      with self.lock:
+        self.written += len(compressed)
+    self._remember(digest, content)
+    self._maybe_sweep()
+    return f"blob:sha256:{digest}"
+
+  def get(self, handle: str) -> Optional[str]:
+    """
+    Returns the content of handle, or None if it is not in the store.
+    """
+    digest = handle.rsplit(":", 1)[-1]
+    with self.lock:
+      if digest in self.recent:
+        self.recent.move_to_end(digest)
+        return self.recent[digest]
+    file = self._file(digest)
+    try:
+      if self.ttl and time.time() - os.path.getmtime(file) > self.ttl:
+        return None
+      with open(file, "rb") as f:
+        content = zlib.decompress(f.read()).decode("utf-8")
+    except FileNotFoundError:
+      return None
+    self._touch(file)
+    self._remember(digest, content)
+    return content
+
+  @staticmethod
+  def _touch(file: str):
+    ### The modification time records the last use, for expiry and least recently used eviction
+    try:
+      os.utime(file)
+    except FileNotFoundError:
+      pass
+
+  def _maybe_sweep(self):
+    with self.lock:
+      now = time.monotonic()
+      if self.written < self.max_bytes / 10 and now - self.swept_at < SWEEP_INTERVAL:
+        return
+      self.written = 0
+      self.swept_at = now
+    self.sweep()
+
+  def sweep(self):
+    """
+    Removes the expired blobs, then the least recently used ones until the store fits in max_bytes.
+    """
+    now = time.time()
+    blobs = []
+    for directory in os.scandir(self.path):
+      if not directory.is_dir():
+        continue
+      for entry in os.scandir(directory.path):
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        blobs.append((stat.st_mtime, stat.st_size, directory.name + entry.name, entry.path))
+
+    total = sum(size for _, size, _, _ in blobs)
+    for used_at, size, digest, file in sorted(blobs):
+      if not (self.ttl and now - used_at > self.ttl) and total <= self.max_bytes:
+        break
+      try:
+        os.remove(file)
+      except FileNotFoundError:
+        pass
+      total -= size
+      with self.lock:
+        self.recent.pop(digest, None)
+
+  def _remember(self, digest: str, content: str):
+    with self.lock:
+      self.recent[digest] = content
+      self.recent.move_to_end(digest)
+      if len(self.recent) > MAX_CACHED_BLOBS:
+        self.recent.popitem(last=False)
+
+def stub(content: str, handle: str) -> str:
+  """
+  Returns what stands for content in the graph state: its beginning and its handle.
+  """
+  return f"{content[:BLOB_PREVIEW_CHARS]}\n[... {len(content)} characters in total, stored as {handle}]"
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+def get_blob_store() -> BlobStore:
+  """
+  Returns the process wide blob store, configured from the environment: BLOB_PATH, BLOB_TTL (seconds)
+  and BLOB_MAX_MB.
+  """
+  global _store
+  with _store_lock:
+    if _store is None:
+      _store = BlobStore(os.getenv("BLOB_PATH", DEFAULT_BLOB_PATH), ttl=float(os.getenv("BLOB_TTL", DEFAULT_TTL_SECONDS)),
+                         max_bytes=int(float(os.getenv("BLOB_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024))
+    return _store
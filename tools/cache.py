@@ -0,0 +1,221 @@
+import os
+import json
+import asyncio
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from tools.frontier import get_frontier
+from tools.instrumentation import count
+
+DEFAULT_CACHE_PATH = "./.cache/cache.sqlite"
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MAX_MB = 512
+
+class DiskCache:
+  """
+  Persistent key-value cache stored in SQLite, shared across threads, entities and runs.
+
+  Values are zlib compressed and addressed by the sha256 of their key; entries expire after
+  ttl seconds and the least recently used ones are evicted once the namespace exceeds max_bytes.
+  """
+
+  def __init__(self, path: str = DEFAULT_CACHE_PATH, namespace: str = "default", ttl: float = DEFAULT_TTL_SECONDS, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+    self.path = path
+    self.namespace = namespace
+    self.ttl = ttl
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+    self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    with self.lock, self.conn:
+      self.conn.execute("PRAGMA journal_mode=WAL")
+      self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+          namespace TEXT NOT NULL,
+          key TEXT NOT NULL,
+          value BLOB NOT NULL,
+          size INTEGER NOT NULL,
+          created_at REAL NOT NULL,
+          accessed_at REAL NOT NULL,
+          PRIMARY KEY (namespace, key)
+        )""")
+      self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at)")
+
+  @staticmethod
+  def hash_key(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+  def get(self, key: str) -> Optional[str]:
+    """
+    Returns the cached value for key, or None if it is missing or expired.
+    """
+    hashed = self.hash_key(key)
+    now = time.time()
+    with self.lock, self.conn:
+      row = self.conn.execute("SELECT value, created_at FROM entries WHERE namespace = ? AND key = ?", (self.namespace, hashed)).fetchone()
+      if row is None:
+        count(f"cache_miss:{self.namespace}")
+        return None
+      if self.ttl and now - row[1] > self.ttl:
+        self.conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, hashed))
+        count(f"cache_miss:{self.namespace}")
+        return None
+      self.conn.execute("UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, self.namespace, hashed))
+    count(f"cache_hit:{self.namespace}")
+    return zlib.decompress(row[0]).decode("utf-8")
+
+  def set(self, key: str, value: str):
+    """
+    Stores value under key, evicting the least recently used entries if the namespace grows past max_bytes.
+    """
+    compressed = zlib.compress(value.encode("utf-8"))
+    now = time.time()
+    with self.lock, self.conn:
+      self.conn.execute(
+        "INSERT OR REPLACE INTO entries (namespace, key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (self.namespace, self.hash_key(key), compressed, len(compressed), now, now))
+      self._evict()
+
+  def _evict(self):
+    total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+    if total <= self.max_bytes:
+      return
+    rows = self.conn.execute("SELECT key, size FROM entries WHERE namespace = ? ORDER BY accessed_at", (self.namespace,))
+    evicted = []
+    for key, size in rows:
+      if total <= self.max_bytes:
+        break
+      evicted.append((self.namespace, key))
+      total -= size
+    self.conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", evicted)
+
+_caches: Dict[str, DiskCache] = {}
+_caches_lock = threading.Lock()
+
+def get_cache(namespace: str) -> DiskCache:
+  """
+  Returns the process wide cache for namespace, configured from the environment:
+  CACHE_PATH, <NAMESPACE>_CACHE_TTL (seconds) and <NAMESPACE>_CACHE_MAX_MB.
+  """
+  with _caches_lock:
+    if namespace not in _caches:
+      prefix = namespace.upper()
+      _caches[namespace] = DiskCache(
+        path=os.getenv("CACHE_PATH", DEFAULT_CACHE_PATH),
+        namespace=namespace,
+        ttl=float(os.getenv(f"{prefix}_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+        max_bytes=int(float(os.getenv(f"{prefix}_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024))
+    return _caches[namespace]
+
+def cached_fetch(namespace: str, key: str, fetch: Callable[[], Tuple[str, bool]], url: Optional[str] = None) -> str:
+  """
+  Returns the value cached under key, or the value fetched, caching it when fetch reports it as cacheable.
+
+  Args:
+      namespace (str): The cache namespace, such as "scrape" or "search".
+      key (str): The cache key.
+      fetch (Callable): Returns the value and whether to cache it.
+      url (str): The page fetched, to run the fetch through the URL frontier within its domain's limits.
+  """
+  cache = get_cache(namespace)
+  value = cache.get(key)
+  if value is not None:
+    return value
+
+  def load() -> str:
+    ### Another entity may have stored the page while this one waited for a slot on its domain
+    value = cache.get(key) if url else None
+    if value is not None:
+      return value
+    value, cacheable = fetch()
+    if cacheable:
+      cache.set(key, value)
+    return value
+
+  return get_frontier().fetch(url, load) if url else load()
+
+async def acached_fetch(namespace: str, key: str, fetch: Callable[[], Awaitable[Tuple[str, bool]]], url: Optional[str] = None) -> str:
+  """
+  Async variant of cached_fetch; the cache is read and written on worker threads, since every lookup is
+  a SQLite transaction that may wait on other processes.
+  """
+  cache = get_cache(namespace)
+  value = await asyncio.to_thread(cache.get, key)
+  if value is not None:
+    return value
+
+  async def load() -> str:
+    value = await asyncio.to_thread(cache.get, key) if url else None
+    if value is not None:
+      return value
+    value, cacheable = await fetch()
+    if cacheable:
+      await asyncio.to_thread(cache.set, key, value)
+    return value
+
+  return await get_frontier().afetch(url, load) if url else await load()
+
+def normalize_prompt(prompt: str) -> str:
+  """
+  Normalizes the serialized messages of a chat request for use as a cache key, dropping the message ids
+  that differ between otherwise identical runs, and the response and usage metadata of earlier replies,
+  which are never sent to the API.
+  """
+  def strip_ids(value: Any) -> Any:
+    if isinstance(value, dict):
+      value = {key: strip_ids(item) for key, item in value.items()}
+      if isinstance(value.get("kwargs"), dict):
+        for key in ["id", "response_metadata", "usage_metadata"]:
+          value["kwargs"].pop(key, None)
+      return value
+    if isinstance(value, list):
+      return [strip_ids(item) for item in value]
+    return value
+
+  try:
+    return json.dumps(strip_ids(json.loads(prompt)), sort_keys=True)
+  except ValueError:
+    return prompt
+
+class LLMCache(BaseCache):
+  """
+  Exact-match cache of chat model responses in the "llm" namespace of the disk cache, keyed by the model
+  parameters, including the bound tool schemas, and the normalized messages.
+
+  Plugged in with ChatOpenAI(cache=LLMCache()), so repeated deterministic calls replay from disk.
+  """
+
+  def __init__(self, cache: Optional[DiskCache] = None):
+    self.cache = cache if cache is not None else get_cache("llm")
+
+  def key(self, prompt: str, llm_string: str) -> str:
+    return f"{llm_string}\n{normalize_prompt(prompt)}"
+
+  def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+    value = self.cache.get(self.key(prompt, llm_string))
+    if value is None:
+      return None
+    try:
+      generations = [loads(generation) for generation in json.loads(value)]
+    except Exception:
+      return None
+    ### Replayed responses keep the usage reported when they were generated, so they are marked as free
+    for generation in generations:
+      message = getattr(generation, "message", None)
+      if message is not None:
+        message.response_metadata = {**message.response_metadata, "cached": True}
+    return generations
+
+  def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE):
+    self.cache.set(self.key(prompt, llm_string), json.dumps([dumps(generation) for generation in return_val]))
+
+  def clear(self, **kwargs: Any):
+    with self.cache.lock, self.cache.conn:
+      self.cache.conn.execute("DELETE FROM entries WHERE namespace = ?", (self.cache.namespace,))
@@ -1,10 +1,11 @@
+from copy import deepcopy
 from typing import List
 from langchain.tools import tool
 from typing import Optional, Type
 from tools.utils import ToolResponse, UpdateDataInput
 from langchain_core.tools import BaseTool
 from langchain_core.pydantic_v1 import BaseModel 
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 
 class UpdateDataTool(BaseTool):
   """Tool that updates state with new data points found."""
@@ -22,21 +23,20 @@ class UpdateDataTool(BaseTool):
   args_schema: Optional[Type[BaseModel]] = UpdateDataInput
   infer_schema: bool = True
   return_direct: bool = True
-  data_points: List[dict] = []
 
-  def __init__(self, data_points_to_search: List[str] = []):
-    super().__init__()
-    self.data_points =  [{"name": dp, "value": None, "reference": None} for dp in data_points_to_search]
-
-  def _run(self, data_to_update: List[dict], run_manager: Optional[CallbackManagerForToolRun] = None) -> ToolResponse:
+  def _run(self, data_to_update: List[dict], data_points: Optional[List[dict]] = None, run_manager: Optional[CallbackManagerForToolRun] = None) -> ToolResponse:
       """
       Update the state with new data points found.
+
+      The data points found so far come from the graph state and the updated list is returned
+      in the context, so one tool instance can serve every entity.
       """
+      data_points = deepcopy(data_points or [])
       for obj in data_to_update:
-          if obj["name"] not in [dp["name"] for dp in self.data_points]:
-             return ToolResponse(result="", context={"error": f"""{obj["name"]}  is not part of data_points_to_search : {[dp["name"] for dp in self.data_points]}, Please update with correct data points"""})
+          if obj["name"] not in [dp["name"] for dp in data_points]:
+             return ToolResponse(result="", context={"error": f"""{obj["name"]}  is not part of data_points_to_search : {[dp["name"] for dp in data_points]}, Please update with correct data points"""})
           
-          for dp in self.data_points:
+          for dp in data_points:
               if dp['name'] == obj['name']:
                   if dp["value"] is None:
                       dp["value"] = obj["value"]
@@ -50,14 +50,17 @@ class UpdateDataTool(BaseTool):
       {data_to_update}
       -----------------
 
-      Required data points to complete the task: {[dp["name"] for dp in self.data_points if dp["value"] is None]}
+      Required data points to complete the task: {[dp["name"] for dp in data_points if dp["value"] is None]}
       Please update search and scrape to find the remaining data points.
       Stop the search or scrape if all required data points are found or if no data points are found in the search list.
       """
-      return ToolResponse(result=f"updated data: {response}", context={})
-  
-  def get_data_points(self):
-    return self.data_points
+      return ToolResponse(result=f"updated data: {response}", context={"data_points": data_points})
+
+  async def _arun(self, data_to_update: List[dict], data_points: Optional[List[dict]] = None, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+      """
+      Update the state with new data points found, inline since no I/O is involved.
+      """
+      return self._run(data_to_update, data_points)
   
 
 @tool("update_data", return_direct=True)
@@ -1,17 +1,49 @@
-from typing import List
+import json
+import asyncio
+import threading
+from typing import List, Tuple
 from termcolor import colored
 from dotenv import load_dotenv
 from typing import Optional, Type
 from firecrawl import FirecrawlApp
-from tools.utils import ScrapeInput, SearchInput, ToolResponse
+from tools import http_client
+from tools.cache import cached_fetch, get_cache
+from tools.instrumentation import span
+from tools.utils import ScrapeInput, SearchInput, ToolResponse, canonical_url, normalize_query
 from langchain_openai import ChatOpenAI
 from langchain_core.tools import BaseTool
 from langchain_core.messages import HumanMessage
 from langchain_core.pydantic_v1 import BaseModel
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 
 load_dotenv()
 
+_firecrawl: Optional[FirecrawlApp] = None
+_firecrawl_lock = threading.Lock()
+
+def get_firecrawl() -> FirecrawlApp:
+  """
+  Returns the process wide FirecrawlApp instead of building one per call.
+  """
+  global _firecrawl
+  with _firecrawl_lock:
+    if _firecrawl is None:
+      _firecrawl = FirecrawlApp()
+    return _firecrawl
+
+def firecrawl_request(endpoint: str, payload: dict) -> dict:
+  """
+  Calls a Firecrawl endpoint as FirecrawlApp does, but through the pooled session with its timeout,
+  retries and the Firecrawl rate limit, returning the data of the response.
+  """
+  app = get_firecrawl()
+  response = http_client.post(f"{app.api_url}/v0/{endpoint}", provider="firecrawl", json=payload,
+                              headers={"Content-Type": "application/json", "Authorization": f"Bearer {app.api_key}"})
+  body = response.json()
+  if response.status_code != 200 or not body.get("success"):
+    raise Exception(f"""firecrawl {endpoint} failed with status {response.status_code}: {body.get("error")}""")
+  return body["data"]
+
 class ScrapeTool(BaseTool):
   name = "scrape"
   description = """
@@ -23,32 +55,29 @@ class ScrapeTool(BaseTool):
   """
   args_schema: Type[BaseModel] = ScrapeInput
   return_direct: bool = True
-  links_already_scraped: list[str] = []
-
-  def __init__(self):
-    super().__init__()
-    self.links_already_scraped =  []
 
   def _run(self, url: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> ToolResponse:
     """
     Scrapes content from a specified URL using FirecrawlApp.
     """
 
-    ### Skippping scraping if the url is already scraped
-    if url in self.links_already_scraped:
-      return ToolResponse(result="", context={"error": f"this url: {url} is already scraped; please use different relevant url from the content scraped before."})
-
+    ### Serving repeat fetches across entities and runs from the shared scrape cache
     try:
-      app = FirecrawlApp()
-      scraped_data = app.scrape_url(url)
+      content = cached_fetch("scrape", canonical_url(url), lambda: self._fetch(url), url=url)
     except Exception as e:
       return ToolResponse(result="", context={"error": f"unable to scrape the URL: {url}, error: {e}"})
 
-    self.links_already_scraped.append(url)
-    return ToolResponse(result=str(scraped_data.get("markdown", "")), context={})
-  
-  def get_links_already_scraped(self):
-    return self.links_already_scraped
+    return ToolResponse(result=content, context={})
+
+  def _fetch(self, url: str) -> Tuple[str, bool]:
+    scraped_data = firecrawl_request("scrape", {"url": url})
+    return str(scraped_data.get("markdown", "")), True
+
+  async def _arun(self, url: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+    """
+    Scrapes content from a specified URL using FirecrawlApp, which only has a blocking client, on a worker thread.
+    """
+    return await asyncio.to_thread(self._run, url)
 
 class SearchTool(BaseTool):
   name = "search"
@@ -77,16 +106,31 @@ class SearchTool(BaseTool):
     """
     Searches for information related to a specific entity using FirecrawlApp.
     """
+    search = self.search_content(query)
+    if "error" in search.context:
+      return search
+    return self.extract_search_information(query, search.result)
+
+  async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+    """
+    Searches for information related to a specific entity using FirecrawlApp without blocking the event loop.
+    """
+    search = await asyncio.to_thread(self.search_content, query)
+    if "error" in search.context:
+      return search
+    return await self.aextract_search_information(query, search.result)
+
+  def search_content(self, query: str) -> ToolResponse:
+    """
+    Returns the raw FirecrawlApp search results for query, from the shared search cache when available.
+    """
+    ### Queries differing only in case or whitespace share one cached result
     params = {"pageOptions": {"fetchPageContent": True}}
-    result = ""
     try:
-      app = FirecrawlApp()
-      search_result = app.search(query, params=params)
-      result = str(search_result)
+      result = cached_fetch("search", f"firecrawl:{normalize_query(query)}", lambda: (str(firecrawl_request("search", {"query": query, **params})), True))
     except Exception as e:
       return ToolResponse(result="", context={"error": f"unable to search the {query}, error: {e}"})
-    
-    return self.extract_search_information(query, result)
+    return ToolResponse(result=result, context={})
   
   def extract_search_information(self, query, content: str) -> ToolResponse:
     """
@@ -97,8 +141,52 @@ class SearchTool(BaseTool):
     Returns:
         ToolResponse: The extracted search information, or an error message if the extraction fails.
     """
+    ### Memoizing the extraction for the same entity, data points and search results
+    cache = get_cache("extract")
+    key = self.extraction_key(query, content)
+    extracted_information = cache.get(key)
+    if extracted_information is not None:
+      return ToolResponse(result=extracted_information, context={})
+
+    try:
+      message = self.extraction_message(query, content)
+      with span("llm:extract"):
+        response = self.llm.invoke([message])
+      extracted_information = response.content
+    except Exception as e:
+      print(colored(f"error while extracting information: {e}", "red"))
+      return ToolResponse(result="", context={"error": f"error while extracting information: {e}"})
+
+    cache.set(key, str(extracted_information))
+    return ToolResponse(result=str(extracted_information), context={})
+
+  async def aextract_search_information(self, query, content: str) -> ToolResponse:
+    """
+    Async variant of extract_search_information.
+    """
+    cache = get_cache("extract")
+    key = self.extraction_key(query, content)
+    extracted_information = await asyncio.to_thread(cache.get, key)
+    if extracted_information is not None:
+      return ToolResponse(result=extracted_information, context={})
 
-    message = HumanMessage(content=f"""
+    try:
+      message = self.extraction_message(query, content)
+      with span("llm:extract"):
+        response = await self.llm.ainvoke([message])
+      extracted_information = response.content
+    except Exception as e:
+      print(colored(f"error while extracting information: {e}", "red"))
+      return ToolResponse(result="", context={"error": f"error while extracting information: {e}"})
+
+    await asyncio.to_thread(cache.set, key, str(extracted_information))
+    return ToolResponse(result=str(extracted_information), context={})
+
+  def extraction_key(self, query, content: str) -> str:
+    return json.dumps([getattr(self.llm, "model_name", ""), self.entity_name, self.data_points_to_search, normalize_query(query), content])
+
+  def extraction_message(self, query, content: str) -> HumanMessage:
+    return HumanMessage(content=f"""
       Below are some search results from the internet about {query}:
       {content}
       -----
@@ -132,13 +220,3 @@ class SearchTool(BaseTool):
           "info_found": []
       }}
     """)
-
-    extracted_information = ""
-    try:
-      response = self.llm.invoke([message])
-      extracted_information = response.content
-    except Exception as e:
-      print(colored(f"error while extracting information: {e}", "red"))
-      return ToolResponse(result="", context={"error": f"error while extracting information: {e}"})
-
-    return ToolResponse(result=str(extracted_information), context={}) 
@@ -0,0 +1,130 @@
+import os
+import time
+import asyncio
+import weakref
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, TypeVar
+from tools.utils import canonical_url, url_domain
+from tools.instrumentation import count
+
+T = TypeVar("T")
+
+FRONTIER_DOMAIN_CONCURRENCY = int(os.getenv("FRONTIER_DOMAIN_CONCURRENCY", 2))
+FRONTIER_DOMAIN_DELAY = float(os.getenv("FRONTIER_DOMAIN_DELAY", 0.5))
+
+class Frontier:
+  """
+  URL frontier shared by every entity of a run.
+
+  Pages are identified by their canonical URL: a page being fetched for one entity is awaited by
+  the others instead of fetched again, while pages already fetched are served by the scrape cache
+  keyed by the same canonical URL; each domain gets at most per_domain fetches in flight,
+  started at least delay seconds apart.
+
+  Args:
+      per_domain (int): The fetches in flight per domain.
+      delay (float): The seconds between fetch starts on one domain.
+  """
+
+  def __init__(self, per_domain: int = FRONTIER_DOMAIN_CONCURRENCY, delay: float = FRONTIER_DOMAIN_DELAY):
+    self.per_domain = max(1, per_domain)
+    self.delay = delay
+    self.in_flight: Dict[tuple, Future] = {}
+    self.domain_slots: Dict[str, threading.Semaphore] = {}
+    self.next_start: Dict[str, float] = {}
+    self.lock = threading.Lock()
+    ### asyncio futures and semaphores are bound to the event loop they were created on
+    self.async_in_flight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, asyncio.Future]]" = weakref.WeakKeyDictionary()
+    self.async_domain_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+  def _start_delay(self, domain: str) -> float:
+    with self.lock:
+      now = time.monotonic()
+      start = max(now, self.next_start.get(domain, now))
+      self.next_start[domain] = start + self.delay
+      return start - now
+
+  def _domain_slot(self, domain: str) -> threading.Semaphore:
+    with self.lock:
+      if domain not in self.domain_slots:
+        self.domain_slots[domain] = threading.Semaphore(self.per_domain)
+      return self.domain_slots[domain]
+
+  def fetch(self, url: str, fetch: Callable[[], T], kind: str = "scrape") -> T:
+    """
+    Runs fetch for url within its domain's limits, or waits for the same page already being fetched.
+    Fetches returning different representations of a page, such as markdown and raw HTML, use distinct kinds.
+    """
+    key = canonical_url(url)
+    with self.lock:
+      leader = (kind, key) not in self.in_flight
+      if leader:
+        self.in_flight[(kind, key)] = Future()
+      future = self.in_flight[(kind, key)]
+    if not leader:
+      count("frontier_joined")
+      return future.result()
+
+    try:
+      domain = url_domain(url)
+      with self._domain_slot(domain):
+        wait = self._start_delay(domain)
+        if wait:
+          time.sleep(wait)
+        result = fetch()
+      future.set_result(result)
+      return result
+    except Exception as e:
+      future.set_exception(e)
+      raise
+    finally:
+      with self.lock:
+        self.in_flight.pop((kind, key), None)
+
+  async def afetch(self, url: str, fetch: Callable[[], Awaitable[T]], kind: str = "scrape") -> T:
+    """
+    Async variant of fetch, sharing the per-domain start delays with the threads of the process.
+    """
+    key = canonical_url(url)
+    loop = asyncio.get_running_loop()
+    in_flight = self.async_in_flight.setdefault(loop, {})
+    if (kind, key) in in_flight:
+      count("frontier_joined")
+      return await asyncio.shield(in_flight[(kind, key)])
+
+    future = in_flight[(kind, key)] = loop.create_future()
+    try:
+      domain = url_domain(url)
+      slots = self.async_domain_slots.setdefault(loop, {})
+      if domain not in slots:
+        slots[domain] = asyncio.Semaphore(self.per_domain)
+      async with slots[domain]:
+        wait = self._start_delay(domain)
+        if wait:
+          await asyncio.sleep(wait)
+        result = await fetch()
+      future.set_result(result)
+      return result
+    except Exception as e:
+      future.set_exception(e)
+      ### Marking the exception as retrieved when no other task was waiting for this page
+      future.exception()
+      raise
+    finally:
+      if not future.done():
+        future.cancel()
+      in_flight.pop((kind, key), None)
+
+_frontier = None
+_frontier_lock = threading.Lock()
+
+def get_frontier() -> Frontier:
+  """
+  Returns the process wide frontier, configured by FRONTIER_DOMAIN_CONCURRENCY and FRONTIER_DOMAIN_DELAY.
+  """
+  global _frontier
+  with _frontier_lock:
+    if _frontier is None:
+      _frontier = Frontier()
+    return _frontier
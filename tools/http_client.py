@@ -0,0 +1,147 @@
+import os
+import asyncio
+import weakref
+import threading
+import httpx
+import requests
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from tenacity import AsyncRetrying, retry, retry_if_exception, stop_after_attempt, wait_exponential
+from tools.ratelimit import Governor, get_governor, retry_after_seconds
+from tools.instrumentation import count
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 60))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 8))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+### Retries after the first attempt
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+
+class RetryableStatusError(Exception):
+  """Raised for responses worth retrying, such as 429 and 5xx."""
+
+  def __init__(self, url: str, status_code: int):
+    super().__init__(f"{url} responded with status {status_code}")
+    self.status_code = status_code
+
+def is_retryable(e: BaseException) -> bool:
+  return isinstance(e, (RetryableStatusError, requests.ConnectionError, requests.Timeout, httpx.TransportError))
+
+def count_retry(retry_state):
+  count("retries:http")
+
+def check_status(url: str, status_code: int):
+  if status_code == 429 or status_code >= 500:
+    raise RetryableStatusError(url, status_code)
+
+def report_status(governor: Optional[Governor], status_code: int, headers):
+  """
+  Lets the governor of the provider adapt its rate to a response, pausing for Retry-After on 429.
+  """
+  if governor is None:
+    return
+  if status_code == 429:
+    governor.throttled(retry_after_seconds(headers))
+  elif status_code < 500:
+    governor.succeeded()
+
+def connections_per_host(provider: Optional[str] = None) -> int:
+  """
+  Returns the connections kept per host: HTTP_MAX_CONNECTIONS_PER_HOST, or the concurrency of provider
+  when it allows more, since every request of an API provider goes to one host.
+  """
+  concurrency = get_governor(provider).concurrency if provider else 0
+  return max(HTTP_MAX_CONNECTIONS_PER_HOST, concurrency or 0)
+
+_sessions: Dict[Optional[str], requests.Session] = {}
+_session_lock = threading.Lock()
+
+def get_session(provider: Optional[str] = None) -> requests.Session:
+  """
+  Returns the process wide requests session of provider, keeping up to connections_per_host
+  connections alive per host.
+  """
+  with _session_lock:
+    if provider not in _sessions:
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=HTTP_MAX_CONNECTIONS, pool_maxsize=connections_per_host(provider), pool_block=True)
+      session.mount("http://", adapter)
+      session.mount("https://", adapter)
+      _sessions[provider] = session
+    return _sessions[provider]
+
+@retry(retry=retry_if_exception(is_retryable), stop=stop_after_attempt(HTTP_MAX_RETRIES + 1), wait=wait_exponential(multiplier=1, max=30), before_sleep=count_retry, reraise=True)
+def request(method: str, url: str, provider: Optional[str] = None, **kwargs) -> requests.Response:
+  """
+  Sends a request through the pooled session with a timeout, retrying connection errors, 429 and 5xx with exponential backoff.
+  With a provider, the request also waits for a slot within that provider's rate limit.
+  """
+  kwargs.setdefault("timeout", HTTP_TIMEOUT)
+  governor = get_governor(provider) if provider else None
+  if governor is not None:
+    governor.acquire()
+  try:
+    response = get_session(provider).request(method, url, **kwargs)
+  finally:
+    if governor is not None:
+      governor.release()
+  report_status(governor, response.status_code, response.headers)
+  check_status(url, response.status_code)
+  return response
+
+def get(url: str, provider: Optional[str] = None, **kwargs) -> requests.Response:
+  return request("GET", url, provider, **kwargs)
+
+def post(url: str, provider: Optional[str] = None, **kwargs) -> requests.Response:
+  return request("POST", url, provider, **kwargs)
+
+### httpx async clients and host semaphores are bound to the event loop they were created on
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+_host_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+def get_async_client() -> httpx.AsyncClient:
+  """
+  Returns the pooled httpx client of the running event loop.
+  """
+  loop = asyncio.get_running_loop()
+  if loop not in _async_clients:
+    limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_CONNECTIONS)
+    _async_clients[loop] = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=limits, follow_redirects=True)
+  return _async_clients[loop]
+
+def host_semaphore(url: str, provider: Optional[str] = None) -> asyncio.Semaphore:
+  semaphores = _host_semaphores.setdefault(asyncio.get_running_loop(), {})
+  key = f"{provider or ''}:{urlsplit(url).netloc.lower()}"
+  if key not in semaphores:
+    semaphores[key] = asyncio.Semaphore(connections_per_host(provider))
+  return semaphores[key]
+
+async def arequest(method: str, url: str, provider: Optional[str] = None, **kwargs) -> httpx.Response:
+  """
+  Async request through the pooled httpx client, limited to connections_per_host requests
+  per host, to the rate limit of provider when given, and retried like request.
+  """
+  governor = get_governor(provider) if provider else None
+  async for attempt in AsyncRetrying(retry=retry_if_exception(is_retryable), stop=stop_after_attempt(HTTP_MAX_RETRIES + 1), wait=wait_exponential(multiplier=1, max=30), before_sleep=count_retry, reraise=True):
+    with attempt:
+      slot = governor.async_slot() if governor is not None else None
+      if slot is not None:
+        await slot.acquire()
+      try:
+        wait = governor.reserve() if governor is not None else 0
+        if wait:
+          await asyncio.sleep(wait)
+        async with host_semaphore(url, provider):
+          response = await get_async_client().request(method, url, **kwargs)
+      finally:
+        if slot is not None:
+          slot.release()
+      report_status(governor, response.status_code, response.headers)
+      check_status(url, response.status_code)
+  return response
+
+async def aget(url: str, provider: Optional[str] = None, **kwargs) -> httpx.Response:
+  return await arequest("GET", url, provider, **kwargs)
+
+async def apost(url: str, provider: Optional[str] = None, **kwargs) -> httpx.Response:
+  return await arequest("POST", url, provider, **kwargs)
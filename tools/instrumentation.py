@@ -0,0 +1,171 @@
+import json
+import math
+import time
+import threading
+from contextvars import ContextVar
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional
+
+class EntityMetrics:
+  """Timings and counters of one entity run, shared by the threads and tasks working on it."""
+
+  def __init__(self, entity: str):
+    self.entity = entity
+    self.started = time.perf_counter()
+    self.stages: Dict[str, dict] = {}
+    self.durations: Dict[str, List[float]] = defaultdict(list)
+    self.counters: Dict[str, int] = defaultdict(int)
+    self.lock = threading.Lock()
+
+  def add(self, stage: str, seconds: float, counters: dict):
+    with self.lock:
+      stats = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+      stats["count"] += 1
+      stats["seconds"] += seconds
+      for name, value in counters.items():
+        stats[name] = stats.get(name, 0) + value
+      self.durations[stage].append(seconds)
+
+  def increment(self, name: str, n: int = 1):
+    with self.lock:
+      self.counters[name] += n
+
+  def record(self, error: Optional[str] = None) -> dict:
+    with self.lock:
+      return {"entity": self.entity, "seconds": round(time.perf_counter() - self.started, 4), "error": error,
+              "stages": {stage: dict(stats) for stage, stats in self.stages.items()}, "counters": dict(self.counters)}
+
+def percentile(values: List[float], fraction: float) -> float:
+  """
+  Nearest-rank percentile of values.
+  """
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+class MetricsRecorder:
+  """
+  Writes one JSONL record per entity and aggregates the stage timings of the whole run.
+
+  Args:
+      path (str): The JSONL file the entity records are appended to.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self.file = open(path, "a", encoding="utf-8")
+    self.durations: Dict[str, List[float]] = defaultdict(list)
+    self.totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    self.counters: Dict[str, int] = defaultdict(int)
+    self.lock = threading.Lock()
+
+  def write(self, metrics: EntityMetrics, error: Optional[str] = None):
+    record = metrics.record(error)
+    with self.lock:
+      self.file.write(json.dumps(record, default=str) + "\n")
+      self.file.flush()
+      self.durations["entity"].append(record["seconds"])
+      with metrics.lock:
+        for stage, durations in metrics.durations.items():
+          self.durations[stage].extend(durations)
+      for stage, stats in record["stages"].items():
+        for name, value in stats.items():
+          if name not in ("count", "seconds"):
+            self.totals[stage][name] += value
+      for name, value in record["counters"].items():
+        self.counters[name] += value
+
+  def summary(self) -> str:
+    """
+    Returns the run summary table, with calls, total, p50 and p95 seconds and summed counters per stage.
+    """
+    with self.lock:
+      lines = [f"{'stage':<24}{'calls':>8}{'total s':>10}{'p50 s':>9}{'p95 s':>9}  counters"]
+      for stage in sorted(self.durations, key=lambda stage: -sum(self.durations[stage])):
+        durations = self.durations[stage]
+        counters = ", ".join(f"{name}={value:g}" for name, value in sorted(self.totals[stage].items()))
+        lines.append(f"{stage:<24}{len(durations):>8}{sum(durations):>10.2f}{percentile(durations, 0.5):>9.2f}{percentile(durations, 0.95):>9.2f}  {counters}")
+      if self.counters:
+        lines.append(", ".join(f"{name}={value}" for name, value in sorted(self.counters.items())))
+      return "\n".join(lines)
+
+  def close(self):
+    self.file.close()
+
+_recorder: Optional[MetricsRecorder] = None
+_current: ContextVar[Optional[EntityMetrics]] = ContextVar("entity_metrics", default=None)
+
+def configure(path: Optional[str]) -> Optional[MetricsRecorder]:
+  """
+  Starts recording entity metrics to path; without a path, spans and counters are no-ops.
+  """
+  global _recorder
+  _recorder = MetricsRecorder(path) if path else None
+  return _recorder
+
+def start_entity(entity: str) -> Optional[EntityMetrics]:
+  """
+  Returns new metrics for entity, or None when no recorder is configured.
+  """
+  return EntityMetrics(entity) if _recorder is not None else None
+
+def finish_entity(metrics: Optional[EntityMetrics], error: Optional[str] = None):
+  recorder = _recorder
+  if metrics is not None and recorder is not None:
+    recorder.write(metrics, error)
+
+@contextmanager
+def bind(metrics: Optional[EntityMetrics]) -> Iterator[Optional[EntityMetrics]]:
+  """
+  Attributes the spans and counters of the block, and of the threads and tasks it starts, to metrics.
+  """
+  token = _current.set(metrics)
+  try:
+    yield metrics
+  finally:
+    _current.reset(token)
+
+@contextmanager
+def entity_run(entity: str) -> Iterator[Optional[EntityMetrics]]:
+  """
+  Collects the spans and counters recorded while processing entity, in this thread or task and the ones it starts.
+  """
+  metrics = start_entity(entity)
+  if metrics is None:
+    yield None
+    return
+  error = None
+  try:
+    with bind(metrics):
+      yield metrics
+  except Exception as e:
+    error = str(e)
+    raise
+  finally:
+    finish_entity(metrics, error)
+
+@contextmanager
+def span(stage: str) -> Iterator[dict]:
+  """
+  Times the block as stage of the current entity; numbers put in the yielded dict, such as tokens or bytes, are summed per stage.
+  """
+  counters: dict = {}
+  metrics = _current.get()
+  if metrics is None:
+    yield counters
+    return
+  started = time.perf_counter()
+  try:
+    yield counters
+  finally:
+    metrics.add(stage, time.perf_counter() - started, counters)
+
+def count(name: str, n: int = 1):
+  """
+  Increments a counter of the current entity, such as cache hits or retries.
+  """
+  metrics = _current.get()
+  if metrics is not None:
+    metrics.increment(name, n)
@@ -1,9 +1,12 @@
-import requests
-from typing import Optional, Type
-from tools.utils import ScrapeInput, ToolResponse
+from typing import Optional, Tuple, Type
+from tools import http_client
+from tools.cache import acached_fetch, cached_fetch
+from tools.utils import ScrapeInput, ToolResponse, canonical_url
 from langchain_core.tools import BaseTool
 from langchain_core.pydantic_v1 import BaseModel
-from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
+
+JINA_READER_URL = "https://r.jina.ai/"
 
 class ScrapeTool(BaseTool):
   name = "scrape"
@@ -12,33 +15,40 @@ class ScrapeTool(BaseTool):
 
     Args:
         url (str): The URL to scrape.
-        
+
     Returns:
         ToolResponse: The scraped content in markdown format, or an error message if scraping fails.
   """
   args_schema: Type[BaseModel] = ScrapeInput
   return_direct: bool = True
-  links_already_scraped: list[str] = []
-
-  def __init__(self):
-    super().__init__()
-    self.links_already_scraped =  []
 
   def _run(self, url: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> ToolResponse:
     """
     Scrapes content from a specified URL using jina AI.
     """
-    ### Skippping scraping if the url is already scraped
-    if url in self.links_already_scraped:
-      return ToolResponse(result="", context={"error": f"this url: {url} is already scraped; please use different relevant url from the content scraped before."})
+    ### Serving repeat fetches across entities and runs from the shared scrape cache
+    try:
+      content = cached_fetch("scrape", canonical_url(url), lambda: self._fetch(url), url=url)
+    except Exception as e:
+      return ToolResponse(result="", context={"error": f"unable to scrape the URL: {url}, error: {e}"})
 
+    return ToolResponse(result=content, context={})
+
+  async def _arun(self, url: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+    """
+    Scrapes content from a specified URL using jina AI without blocking the event loop.
+    """
     try:
-      response = requests.get("https://r.jina.ai/" + url)
+      content = await acached_fetch("scrape", canonical_url(url), lambda: self._afetch(url), url=url)
     except Exception as e:
       return ToolResponse(result="", context={"error": f"unable to scrape the URL: {url}, error: {e}"})
 
-    self.links_already_scraped.append(url)
-    return ToolResponse(result=str(response.text), context={})
-  
-  def get_links_already_scraped(self):
-    return self.links_already_scraped
+    return ToolResponse(result=content, context={})
+
+  def _fetch(self, url: str) -> Tuple[str, bool]:
+    response = http_client.get(JINA_READER_URL + url, provider="jina")
+    return str(response.text), response.ok
+
+  async def _afetch(self, url: str) -> Tuple[str, bool]:
+    response = await http_client.aget(JINA_READER_URL + url, provider="jina")
+    return str(response.text), response.is_success
@@ -0,0 +1,221 @@
+import os
+import re
+import time
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from tools.instrumentation import count
+
+### Requests and tokens per minute, and calls in flight, allowed per provider unless overridden through
+### RATE_LIMIT_<PROVIDER>_RPM, RATE_LIMIT_<PROVIDER>_TPM and RATE_LIMIT_<PROVIDER>_CONCURRENCY; 0 disables a limit.
+### OpenAI quotas depend on the account tier, so they only apply once configured
+DEFAULT_LIMITS = {
+  "openai": {"rpm": 0, "tpm": 0, "concurrency": 50},
+  "jina": {"rpm": 200, "tpm": 0, "concurrency": 20},
+  "tavily": {"rpm": 100, "tpm": 0, "concurrency": 10},
+  "firecrawl": {"rpm": 20, "tpm": 0, "concurrency": 5},
+}
+MAX_ATTEMPTS = 4
+MAX_BACKOFF = 30
+### Errors of the OpenAI client worth retrying, now that its own retries are off
+TRANSIENT_ERRORS = ("APIConnectionError", "APITimeoutError", "InternalServerError")
+MIN_RATE_FACTOR = 0.1
+
+class TokenBucket:
+  """Per-minute budget refilled continuously; reservations may go into debt and report how long to wait."""
+
+  def __init__(self, per_minute: float):
+    self.per_minute = per_minute
+    self.available = per_minute
+    self.updated_at = time.monotonic()
+
+  def reserve(self, amount: float, rate_factor: float = 1.0) -> float:
+    now = time.monotonic()
+    rate = self.per_minute * rate_factor / 60
+    self.available = min(self.per_minute, self.available + (now - self.updated_at) * rate)
+    self.updated_at = now
+    self.available -= amount
+    return 0.0 if self.available >= 0 else -self.available / rate
+
+class Governor:
+  """
+  Keeps the calls to one provider under its request and token quotas.
+
+  Rates back off multiplicatively on every 429 and recover additively on success, and a
+  Retry-After from the provider pauses every caller until it has passed.
+  """
+
+  def __init__(self, name: str, rpm: float, tpm: float = 0, concurrency: int = 0):
+    self.name = name
+    self.requests = TokenBucket(rpm) if rpm else None
+    self.tokens = TokenBucket(tpm) if tpm else None
+    self.concurrency = concurrency
+    self.slots = threading.BoundedSemaphore(concurrency) if concurrency else None
+    self.async_slots: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+    self.rate_factor = 1.0
+    self.blocked_until = 0.0
+    self.lock = threading.Lock()
+
+  def reserve(self, tokens: int = 0) -> float:
+    """
+    Reserves one request and tokens, returning the seconds to wait before sending it.
+    """
+    with self.lock:
+      wait = max(0.0, self.blocked_until - time.monotonic())
+      if self.requests is not None:
+        wait = max(wait, self.requests.reserve(1, self.rate_factor))
+      if self.tokens is not None and tokens:
+        wait = max(wait, self.tokens.reserve(tokens, self.rate_factor))
+      return wait
+
+  def record(self, tokens: int):
+    """
+    Charges tokens only known after the call, such as the completion, against the quota.
+    """
+    if self.tokens is not None and tokens:
+      with self.lock:
+        self.tokens.reserve(tokens, self.rate_factor)
+
+  def throttled(self, retry_after: Optional[float] = None):
+    with self.lock:
+      self.rate_factor = max(MIN_RATE_FACTOR, self.rate_factor * 0.5)
+      pause = retry_after if retry_after is not None else 60 / ((self.requests.per_minute if self.requests else 60) * self.rate_factor)
+      self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+    count(f"throttled:{self.name}")
+    print(f"{self.name} rate limited, pausing {pause:.1f}s at {self.rate_factor:.0%} of the configured rate")
+
+  def succeeded(self):
+    with self.lock:
+      self.rate_factor = min(1.0, self.rate_factor + 0.05)
+
+  def acquire(self, tokens: int = 0):
+    if self.slots is not None:
+      self.slots.acquire()
+    wait = self.reserve(tokens)
+    if wait:
+      time.sleep(wait)
+
+  def release(self):
+    if self.slots is not None:
+      self.slots.release()
+
+  def async_slot(self) -> Optional[asyncio.Semaphore]:
+    if not self.concurrency:
+      return None
+    loop = asyncio.get_running_loop()
+    if loop not in self.async_slots:
+      self.async_slots[loop] = asyncio.Semaphore(self.concurrency)
+    return self.async_slots[loop]
+
+_governors: Dict[str, Governor] = {}
+_governors_lock = threading.Lock()
+
+def get_governor(provider: str) -> Governor:
+  """
+  Returns the process wide governor of provider.
+  """
+  with _governors_lock:
+    if provider not in _governors:
+      limits = DEFAULT_LIMITS.get(provider, {"rpm": 0, "tpm": 0, "concurrency": 0})
+      prefix = f"RATE_LIMIT_{provider.upper()}"
+      _governors[provider] = Governor(
+        provider,
+        rpm=float(os.getenv(f"{prefix}_RPM", limits["rpm"])),
+        tpm=float(os.getenv(f"{prefix}_TPM", limits["tpm"])),
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", limits["concurrency"])))
+    return _governors[provider]
+
+def retry_after_seconds(headers: Any) -> Optional[float]:
+  """
+  Parses a Retry-After header given in seconds or as an HTTP date.
+  """
+  value = headers.get("retry-after") if headers is not None else None
+  if not value:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+  except (TypeError, ValueError):
+    return None
+
+def rate_limit_of(e: BaseException) -> Optional[Tuple[Optional[float]]]:
+  """
+  Returns a one-item tuple with the Retry-After seconds if e is a 429 from a provider, otherwise None.
+  """
+  response = getattr(e, "response", None)
+  status_code = getattr(e, "status_code", None) or getattr(response, "status_code", None)
+  if status_code == 429 or (status_code is None and re.search(r"\b429\b", str(e))):
+    return (retry_after_seconds(getattr(response, "headers", None)),)
+  return None
+
+def is_transient(e: BaseException) -> bool:
+  response = getattr(e, "response", None)
+  status_code = getattr(e, "status_code", None) or getattr(response, "status_code", None)
+  return (isinstance(status_code, int) and status_code >= 500) or type(e).__name__ in TRANSIENT_ERRORS
+
+def backoff(governor: Governor, e: BaseException, attempt: int) -> Optional[float]:
+  """
+  Returns the seconds to wait before retrying after e, or None when e is not worth retrying.
+  A 429 throttles the whole provider instead, so every caller waits for it.
+  """
+  if attempt == MAX_ATTEMPTS - 1:
+    return None
+  limited = rate_limit_of(e)
+  if limited is not None:
+    governor.throttled(limited[0])
+    return 0.0
+  if is_transient(e):
+    count(f"retries:{governor.name}")
+    return min(MAX_BACKOFF, 2 ** attempt)
+  return None
+
+def call(provider: str, fn: Callable[[], Any], tokens: int = 0) -> Any:
+  """
+  Calls fn within the quota of provider, pausing and retrying when the provider answers 429
+  and backing off on connection errors and 5xx.
+  """
+  governor = get_governor(provider)
+  for attempt in range(MAX_ATTEMPTS):
+    governor.acquire(tokens)
+    try:
+      result = fn()
+      governor.succeeded()
+      return result
+    except Exception as e:
+      pause = backoff(governor, e, attempt)
+      if pause is None:
+        raise
+    finally:
+      governor.release()
+    if pause:
+      time.sleep(pause)
+
+async def acall(provider: str, fn: Callable[[], Awaitable[Any]], tokens: int = 0) -> Any:
+  """
+  Async variant of call, waiting without blocking the event loop.
+  """
+  governor = get_governor(provider)
+  slot = governor.async_slot()
+  for attempt in range(MAX_ATTEMPTS):
+    if slot is not None:
+      await slot.acquire()
+    try:
+      wait = governor.reserve(tokens)
+      if wait:
+        await asyncio.sleep(wait)
+      result = await fn()
+      governor.succeeded()
+      return result
+    except Exception as e:
+      pause = backoff(governor, e, attempt)
+      if pause is None:
+        raise
+    finally:
+      if slot is not None:
+        slot.release()
+    if pause:
+      await asyncio.sleep(pause)
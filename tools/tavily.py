@@ -1,13 +1,28 @@
+import os
 from dotenv import load_dotenv
-from typing import Optional, Type
-from tools.utils import SearchInput, ToolResponse
+from typing import List, Optional, Tuple, Type
+from tools import http_client
+from tools.cache import acached_fetch, cached_fetch
+from tools.utils import SearchInput, ToolResponse, normalize_query
 from langchain_core.tools import BaseTool
 from langchain_core.pydantic_v1 import BaseModel
-from langchain_core.callbacks import CallbackManagerForToolRun
-from langchain_community.tools.tavily_search import TavilySearchResults
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun, CallbackManagerForToolRun
 
 load_dotenv()
 
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+TAVILY_MAX_RESULTS = 5
+
+def search_payload(query: str) -> dict:
+  """
+  Returns the Tavily search request sent by the LangChain Tavily tool, with its defaults.
+  """
+  return {"api_key": os.getenv("TAVILY_API_KEY"), "query": query, "max_results": TAVILY_MAX_RESULTS, "search_depth": "advanced",
+          "include_answer": False, "include_raw_content": False, "include_images": False}
+
+def clean_results(body: dict) -> List[dict]:
+  return [{"url": result["url"], "content": result["content"]} for result in body.get("results", [])]
+
 class SearchTool(BaseTool):
   name = "search"
   description = """
@@ -29,14 +44,33 @@ class SearchTool(BaseTool):
     """
     Searches for information related to a specific entity using FirecrawlApp.
     """
-    params = {"pageOptions": {"fetchPageContent": True}}
-    result = ""
+    ### Queries differing only in case or whitespace share one cached result
     try:
-      tool = TavilySearchResults()
-      search_result = tool.invoke({"query": query})
-      result = str(search_result)
+      result = cached_fetch("search", f"tavily:{normalize_query(query)}", lambda: self._search(query))
     except Exception as e:
       return ToolResponse(result="", context={"error": f"unable to search the {query}, error: {e}"})
-    
-    return ToolResponse(result=result, context={}) 
-  
\ No newline at end of file
+    return ToolResponse(result=result, context={})
+
+  async def _arun(self, query: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> ToolResponse:
+    """
+    Searches for information related to a specific entity without blocking the event loop.
+    """
+    try:
+      result = await acached_fetch("search", f"tavily:{normalize_query(query)}", lambda: self._asearch(query))
+    except Exception as e:
+      return ToolResponse(result="", context={"error": f"unable to search the {query}, error: {e}"})
+    return ToolResponse(result=result, context={})
+
+  def _search(self, query: str) -> Tuple[str, bool]:
+    ### Through the pooled session, with its timeout, retries and the Tavily rate limit
+    response = http_client.post(TAVILY_SEARCH_URL, provider="tavily", json=search_payload(query))
+    response.raise_for_status()
+    search_result = clean_results(response.json())
+    ### Only well formed result lists are cached
+    return str(search_result), isinstance(search_result, list)
+
+  async def _asearch(self, query: str) -> Tuple[str, bool]:
+    response = await http_client.apost(TAVILY_SEARCH_URL, provider="tavily", json=search_payload(query))
+    response.raise_for_status()
+    search_result = clean_results(response.json())
+    return str(search_result), isinstance(search_result, list)
@@ -1,4 +1,5 @@
 from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from langchain_core.pydantic_v1 import BaseModel, Field
 
 class ToolResponse(BaseModel):
@@ -14,3 +15,39 @@ class SearchInput(BaseModel):
 class UpdateDataInput(BaseModel):
   """Input for the Update Data tool."""
   data_to_update: List[dict] = Field(description="""The data points found, which should follow the format [{"name": "xxx", "value": "yyy", "reference": "url"}]""")
+  data_points: List[dict] = Field(default_factory=list, description="""The data points found so far, passed from the graph state.""")
+
+### Query parameters that only track the visitor and never change the page
+TRACKING_PARAMS = {"gclid", "fbclid", "msclkid", "dclid", "yclid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src", "_ga", "_gl", "_hsenc", "_hsmi"}
+
+def canonical_url(url: str) -> str:
+  """
+  Canonicalizes a URL so spellings of the same page share one cache entry and one fetch: https scheme,
+  lower-cased host without www. and default port, no tracking parameters, sorted query, no fragment
+  and no trailing slash.
+  """
+  url = url.strip()
+  if "://" not in url:
+    url = "https://" + url
+  parts = urlsplit(url)
+  host = (parts.hostname or "").lower()
+  if host.startswith("www."):
+    host = host[4:]
+  if parts.port and parts.port not in (80, 443):
+    host = f"{host}:{parts.port}"
+  query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                 if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS)
+  path = parts.path.rstrip("/")
+  return urlunsplit(("https", host, path, urlencode(query), ""))
+
+def url_domain(url: str) -> str:
+  """
+  Returns the host a URL is served from, without www., for per-domain limits.
+  """
+  return canonical_url(url).split("/")[2]
+
+def normalize_query(query: str) -> str:
+  """
+  Normalizes a search query for use as a cache key: lower-cased with collapsed whitespace.
+  """
+  return " ".join(query.lower().split())
@@ -1,18 +1,20 @@
-from graph import workflow
+from graph import compiled_workflow
+from agent_nodes import ReplaceMessages
 from typing import Any, List
 from tools.custom import UpdateDataTool, update_data_definition
 from tools.jinaai import ScrapeTool
-from langgraph.prebuilt.tool_executor import ToolExecutor
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.utils.function_calling import convert_to_openai_tool
 
-def website_scrap(llm, model: str, links: List[str], entity_name: str, data_points_to_search: List[str], links_already_scraped: List[str]) -> (dict[str, Any] | Any):
+def scrape_tools():
+  """
+  Returns the tools executed by the website scrape graph and the definitions bound to the model.
+  """
+  update_data = UpdateDataTool()
   scrape = ScrapeTool()
-  update_data = UpdateDataTool(data_points_to_search)
-  llm = llm.bind(tools=[convert_to_openai_tool(tool) for tool in [update_data_definition, scrape]])
-  tool_executor = ToolExecutor([update_data, scrape])
+  return [update_data, scrape], [update_data_definition, scrape]
 
-  app = workflow(llm=llm, model=model, tool_executor=tool_executor)
+def website_scrap(llm, model: str, links: List[str], entity_name: str, data_points_to_search: List[str], links_already_scraped: List[str]) -> (dict[str, Any] | Any):
+  app = compiled_workflow("website_scrap", llm, model, scrape_tools)
 
   system_message = SystemMessage(content="""
     You are a world class web scraper, you are great at finding information on urls;
@@ -28,7 +30,7 @@ def website_scrap(llm, model: str, links: List[str], entity_name: str, data_poin
     You NEVER ask user for inputs or permissions, just go ahead do the best thing possible without
     asking for permission or guidance from user;
                           
-    You NEVER make more than two tool_calls in a single turn;
+    You NEVER make more than four tool_calls in a single turn;
   """)
 
   web_scrape = HumanMessage(content=f"""
@@ -44,13 +46,15 @@ def website_scrap(llm, model: str, links: List[str], entity_name: str, data_poin
     Need not search for data points that are already found.
   """)
 
-  inputs = {"messages": [system_message, web_scrape], 
+  inputs = {"messages": ReplaceMessages([system_message, web_scrape]), 
+            "entity_name": entity_name,
             "data_points": [{"name": dp, "value": None, "reference": None} for dp in data_points_to_search],
-            "links_already_scraped": links_already_scraped}
+            "links_already_scraped": links_already_scraped,
+            "summary": "", "turns": 0, "tokens": 0, "cost": 0.0, "elapsed": 0.0}
   config = {"recursion_limit": 30}
-  app.invoke(inputs,config=config)
+  output = app.invoke(inputs,config=config)
 
-  return {"data_points": update_data.get_data_points(), "links_already_scraped": scrape.get_links_already_scraped()}
+  return {"data_points": output["data_points"], "links_already_scraped": output["links_already_scraped"]}
 
 
   
\ No newline at end of file